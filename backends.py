@@ -0,0 +1,130 @@
+import asyncio
+import json
+import time
+
+from resilience import RETRYABLE_ERRORS
+
+class Backend:
+    """One OpenAI-compatible endpoint: the official API or a self-hosted mirror.
+
+    models limits which models it serves (None serves all of them), and
+    api_key, if set, is used instead of the guild's key, for mirrors that
+    have their own credentials.
+    """
+
+    # Weight of the newest sample in the latency moving average
+    SMOOTHING = 0.2
+
+    def __init__(self, name: str, base_url: str, models=None, api_key=None):
+        self.name = name
+        self.base_url = base_url
+        self.models = set(models) if models else None
+        self.api_key = api_key
+        # Moving average of seconds to the first token; None until measured
+        self.latency = None
+        self.failures = 0
+        self.down_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def serves(self, model: str):
+        return self.models is None or model in self.models
+
+    def healthy(self, now: float):
+        return self.down_until <= now
+
+    def observe(self, seconds: float):
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += self.SMOOTHING * (seconds - self.latency)
+
+def parse_backends(spec: str, default_url: str):
+    """Parse DEEPSEEK_BACKENDS, a JSON list of {"name", "base_url", "models", "api_key"}.
+
+    An empty spec means the single default endpoint.
+    """
+    if not spec:
+        return [Backend("deepseek", default_url)]
+    return [
+        Backend(
+            entry.get("name") or entry["base_url"],
+            entry["base_url"],
+            models=entry.get("models"),
+            api_key=entry.get("api_key"),
+        )
+        for entry in json.loads(spec)
+    ]
+
+class BackendPool:
+    """Routes each attempt to the fastest healthy backend for its model.
+
+    Backends are ranked by their latency moving average, with unmeasured
+    ones tried first so every backend gets sampled. A backend that fails
+    failures_to_mark_down times in a row is skipped for cooldown seconds.
+    Within one request, retries and hedged attempts go to backends that
+    request hasn't tried yet, so a failure fails over straight away.
+    """
+
+    def __init__(self, backends, failures_to_mark_down=2, cooldown=30.0):
+        self.backends = backends
+        self.failures_to_mark_down = failures_to_mark_down
+        self.cooldown = cooldown
+
+    def pick(self, model: str, exclude=()):
+        candidates = [backend for backend in self.backends if backend.serves(model)] or self.backends
+        fresh = [backend for backend in candidates if backend not in exclude] or candidates
+        now = time.monotonic()
+        healthy = [backend for backend in fresh if backend.healthy(now)]
+        if healthy:
+            return min(healthy, key=lambda backend: backend.latency or 0.0)
+        # Everything is down: try whichever is due back soonest
+        return min(fresh, key=lambda backend: backend.down_until)
+
+    async def attempt(self, model: str, tried: list, request):
+        """Run request(backend, on_first_token) on the best backend not yet in tried.
+
+        on_first_token() should be called when the first token arrives; for
+        a call that doesn't stream, the whole call is timed instead.
+        """
+        backend = self.pick(model, tried)
+        tried.append(backend)
+        backend.requests += 1
+        sent = time.monotonic()
+        first_token = False
+
+        def on_first_token():
+            nonlocal first_token
+            if not first_token:
+                first_token = True
+                backend.observe(time.monotonic() - sent)
+
+        try:
+            result = await request(backend, on_first_token)
+        except asyncio.CancelledError:
+            # Cut off by the deadline or a faster hedge: it took at least this long
+            if not first_token:
+                backend.observe(time.monotonic() - sent)
+            raise
+        except (*RETRYABLE_ERRORS, asyncio.TimeoutError):
+            backend.errors += 1
+            backend.failures += 1
+            if backend.failures >= self.failures_to_mark_down:
+                backend.down_until = time.monotonic() + self.cooldown
+            raise
+        on_first_token()
+        backend.failures = 0
+        backend.down_until = 0.0
+        return result
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            backend.name: {
+                "healthy": backend.healthy(now),
+                "latency": backend.latency,
+                "requests": backend.requests,
+                "errors": backend.errors,
+            }
+            for backend in self.backends
+        }
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import time
+
+# Keys a JSONL line may use for its prompt, in order of preference
+PROMPT_KEYS = ("prompt", "question", "content")
+
+class BatchError(Exception):
+    """The uploaded file can't be run as a batch; the message is shown to the user."""
+
+def parse_prompts(filename: str, data: bytes, max_prompts: int):
+    """Read prompts from a .jsonl file (one string or {"prompt": ...} per line) or plain text (one per line)."""
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise BatchError("The file must be UTF-8 text.")
+
+    prompts = []
+    jsonl = filename.lower().endswith((".jsonl", ".json"))
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        if jsonl:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                raise BatchError(f"Line {number} is not valid JSON.")
+            if isinstance(entry, dict):
+                entry = next((entry[key] for key in PROMPT_KEYS if isinstance(entry.get(key), str)), None)
+            if not isinstance(entry, str) or not entry.strip():
+                raise BatchError(f"Line {number} has no prompt; use a string or an object with a \"prompt\" field.")
+            line = entry.strip()
+        prompts.append(line)
+
+    if not prompts:
+        raise BatchError("The file doesn't contain any prompts.")
+    if len(prompts) > max_prompts:
+        raise BatchError(f"A batch can have at most {max_prompts} prompts; this file has {len(prompts)}.")
+    return prompts
+
+class Collected:
+    """A reply that only keeps the text, for answers that go into a file instead of a message."""
+
+    def __init__(self):
+        self.text = ""
+
+    async def thinking(self):
+        pass
+
+    async def feed(self, delta: str):
+        self.text += delta
+
+    async def finish(self):
+        return self.text
+
+async def run_batch(prompts, answer, concurrency: int, on_progress=None, progress_interval=5.0, describe=str):
+    """Answer every prompt with answer(prompt) -> (model, text), at most concurrency at a time.
+
+    Returns one {"prompt", "model", "answer"} or {"prompt", "error"} dict per
+    prompt, in input order; a failed prompt doesn't stop the others and
+    its error is recorded as describe(error).
+    on_progress(done, failed) is awaited at most every progress_interval
+    seconds while the batch runs, and never concurrently with itself.
+    """
+    results = [None] * len(prompts)
+    semaphore = asyncio.Semaphore(concurrency)
+    done = 0
+    failed = 0
+    last_progress = time.monotonic()
+    progress = None
+
+    async def report():
+        try:
+            await on_progress(done, failed)
+        except Exception as e:
+            print(f"Error updating batch progress: {str(e)}")
+
+    async def one(index, prompt):
+        nonlocal done, failed, last_progress, progress
+        async with semaphore:
+            try:
+                model, text = await answer(prompt)
+                results[index] = {"prompt": prompt, "model": model, "answer": text}
+            except Exception as e:
+                failed += 1
+                results[index] = {"prompt": prompt, "error": describe(e)}
+        done += 1
+        now = time.monotonic()
+        if on_progress is not None and now - last_progress >= progress_interval and (progress is None or progress.done()):
+            last_progress = now
+            progress = asyncio.create_task(report())
+
+    await asyncio.gather(*(one(index, prompt) for index, prompt in enumerate(prompts)))
+    if progress is not None:
+        await progress
+    return results
+
+def format_results(results, jsonl: bool):
+    """Render batch results as JSONL, or as Markdown for plain-text batches."""
+    if jsonl:
+        return "".join(json.dumps(result, ensure_ascii=False) + "\n" for result in results)
+    sections = []
+    for number, result in enumerate(results, 1):
+        body = result["answer"] if "error" not in result else f"**Error:** {result['error']}"
+        sections.append(f"## {number}. {result['prompt']}\n\n{body}\n")
+    return "\n".join(sections)
@@ -0,0 +1,88 @@
+"""Compare settings lookups on the shared connection against connect-per-call.
+
+Usage: python benchmarks/bench_database.py [--ops N] [--guilds N]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import aiosqlite
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+
+
+class ConnectPerCallDatabase:
+    """The previous design: every method opens its own connection."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    async def get_api_key(self, guild_id):
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute(
+                "SELECT api_key FROM settings WHERE guild_id = ?",
+                (guild_id,)
+            ) as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result else None
+
+    async def get_model(self, guild_id):
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute(
+                "SELECT current_model FROM settings WHERE guild_id = ?",
+                (guild_id,)
+            ) as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result else 'deepseek-chat'
+
+
+async def seed(db_path, guilds):
+    db = Database(db_path)
+    await db.init()
+    for guild_id in range(guilds):
+        await db.set_api_key(guild_id, f"sk-{guild_id}")
+    await db.close()
+
+
+async def run(db, ops, guilds):
+    # One mention costs a get_api_key and a get_model
+    start = time.perf_counter()
+    for i in range(ops):
+        guild_id = i % guilds
+        await db.get_api_key(guild_id)
+        await db.get_model(guild_id)
+    elapsed = time.perf_counter() - start
+    return (ops * 2) / elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--guilds", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        await seed(db_path, args.guilds)
+
+        legacy = await run(ConnectPerCallDatabase(db_path), args.ops, args.guilds)
+
+        shared = Database(db_path)
+        await shared.init()
+        try:
+            pooled = await run(shared, args.ops, args.guilds)
+        finally:
+            await shared.close()
+
+    print(f"connect-per-call : {legacy:10.0f} ops/sec")
+    print(f"shared connection: {pooled:10.0f} ops/sec")
+    print(f"speedup          : {pooled / legacy:10.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+"""Measure the retrieval index: indexing throughput and search latency.
+
+Usage: python benchmarks/bench_retrieval.py [--messages 100000] [--queries 200]
+
+Indexes synthetic channel history for one guild through RetrievalIndex,
+as the bot does for channels with /memory on, then times searches that
+should find a planted message. Exits non-zero if the planted messages
+aren't found.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from retrieval import RetrievalIndex
+
+WORDS = (
+    "deploy server build release branch merge review ticket sprint meeting lunch coffee weekend game "
+    "music movie weather train office laptop monitor keyboard python rust docker cache queue worker "
+    "database index backup restore alert dashboard metric latency budget invoice customer support"
+).split()
+CHANNELS = 8
+
+
+def chatter(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 24)))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--batch", type=int, default=1000, help="messages per flush")
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "retrieval.db"))
+        await db.init()
+        index = RetrievalIndex(db, directory=os.path.join(tmp, "retrieval"), dim=args.dim)
+        await index.init()
+        for channel_id in range(CHANNELS):
+            await index.set_enabled(1, channel_id, True)
+
+        # One distinctive message per query, hidden among the chatter
+        planted = {}
+        for number in range(args.queries):
+            planted[rng.randrange(args.messages)] = number
+
+        started = time.perf_counter()
+        for message_id in range(args.messages):
+            if message_id in planted:
+                number = planted[message_id]
+                content = f"the zebra{number} password rotation for vault{number} happens on fridays"
+            else:
+                content = chatter(rng)
+            index.add(1, message_id % CHANNELS, message_id, f"user{message_id % 50}", content)
+            if (message_id + 1) % args.batch == 0:
+                await index.flush()
+        await index.flush()
+        elapsed = time.perf_counter() - started
+        print(f"indexed {args.messages} messages in {elapsed:.1f} s ({args.messages / elapsed:,.0f}/s)")
+
+        timings = []
+        found = 0
+        for message_id, number in planted.items():
+            query = f"when does the zebra{number} vault{number} password rotation happen?"
+            started = time.perf_counter()
+            results = await index.search(1, message_id % CHANNELS, query)
+            timings.append((time.perf_counter() - started) * 1000)
+            found += bool(results) and f"zebra{number} " in results[0]
+        timings.sort()
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        print(f"search: p50 {statistics.median(timings):.2f} ms, p99 {p99:.2f} ms over {len(timings)} queries")
+        print(f"planted message ranked first for {found}/{len(planted)} queries")
+
+        await index.close()
+        await db.close()
+
+    if found < len(planted) * 0.95:
+        print("FAILED")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
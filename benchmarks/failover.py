@@ -0,0 +1,116 @@
+"""Check backend routing and failover against local stub servers.
+
+Usage: python benchmarks/failover.py [--requests 60]
+
+Starts three fake DeepSeek servers (fast, slow, and one that always fails
+with 500), points the bot at all of them through DEEPSEEK_BACKENDS and
+sends completions through DeepseekBot.generate. Then the fast server is
+stopped mid-run. Exits non-zero unless most traffic went to the fast
+backend and no request failed after it went away.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_deepseek import FakeDeepSeek
+
+
+class Collect:
+    """A reply that just keeps the text."""
+
+    def __init__(self):
+        self.text = ""
+
+    async def thinking(self):
+        pass
+
+    async def feed(self, delta):
+        self.text += delta
+
+    async def finish(self):
+        return self.text
+
+
+async def send(bot, count, offset, concurrency=8):
+    semaphore = asyncio.Semaphore(concurrency)
+    failures = 0
+
+    async def one(index):
+        nonlocal failures
+        async with semaphore:
+            messages = [{"role": "user", "content": f"question {offset + index}"}]
+            try:
+                await bot.generate(index % 4, "sk-failover", "deepseek-chat", messages, Collect())
+            except Exception as e:
+                failures += 1
+                print(f"request {offset + index} failed: {type(e).__name__}: {e}")
+
+    await asyncio.gather(*(one(index) for index in range(count)))
+    return failures
+
+
+def report(bot, title):
+    print(title)
+    for name, stats in bot.backends.stats().items():
+        latency = "-" if stats["latency"] is None else f"{stats['latency'] * 1000:.0f} ms"
+        state = "healthy" if stats["healthy"] else "down"
+        print(f"  {name:<6} {state:<8} {latency:>8} {stats['requests']:>4} requests {stats['errors']:>3} errors")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=60)
+    args = parser.parse_args()
+
+    servers = {
+        "fast": FakeDeepSeek(latency=0.02, token_interval=0),
+        "slow": FakeDeepSeek(latency=0.2, token_interval=0),
+        "broken": FakeDeepSeek(latency=0.01, token_interval=0, error_rate=1.0),
+    }
+    backends = [{"name": name, "base_url": await server.start()} for name, server in servers.items()]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({
+            "DB_PATH": os.path.join(tmp, "failover.db"),
+            "RETRIEVAL_DIR": os.path.join(tmp, "retrieval"),
+            "DEEPSEEK_BACKENDS": json.dumps(backends),
+            "LLM_MAX_RETRIES": "3",
+            "LLM_RETRY_BACKOFF": "0.01",
+            "LLM_BREAKER_FAILURES": "1000",
+        })
+        from bot import create_bot
+
+        bot = create_bot()
+        await bot.setup_hook()
+        try:
+            failures = await send(bot, args.requests, 0)
+            report(bot, f"All backends up: {failures} failed")
+            stats = bot.backends.stats()
+            fast_share = stats["fast"]["requests"] / sum(entry["requests"] for entry in stats.values())
+
+            await servers["fast"].stop()
+            before = {name: entry["requests"] for name, entry in bot.backends.stats().items()}
+            failovers = await send(bot, args.requests // 2, args.requests)
+            report(bot, f"Fast backend stopped: {failovers} failed")
+            after = bot.backends.stats()
+            slow_served = after["slow"]["requests"] - before["slow"]
+        finally:
+            await bot.shutdown()
+            for server in servers.values():
+                await server.stop()
+
+    print(f"fast backend share with all up: {fast_share:.0%}; slow backend took {slow_served} after failover")
+    if failures or failovers or fast_share < 0.5 or slow_served < args.requests // 2:
+        print("FAILED")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
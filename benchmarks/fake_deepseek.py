@@ -0,0 +1,190 @@
+"""A local stand-in for the DeepSeek (OpenAI-compatible) API.
+
+Usage: python benchmarks/fake_deepseek.py [--port 8001] [--latency 0.2] [--error-rate 0.01]
+
+Point the bot at it with DEEPSEEK_BASE_URL=http://127.0.0.1:8001. Keys that
+start with "sk-bad" are rejected with 401; every other key is accepted.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import web
+
+
+class FakeDeepSeek:
+    """Serves /chat/completions and /models with configurable behaviour.
+
+    latency is the delay before the first token (or the whole response when
+    not streaming), token_interval the delay between streamed chunks, and
+    error_rate the fraction of completions answered with error_status.
+    """
+
+    def __init__(self, latency=0.05, token_interval=0.005, response_chars=600, chunk_chars=12,
+                 error_rate=0.0, error_status=500, seed=None):
+        self.latency = latency
+        self.token_interval = token_interval
+        self.response_chars = response_chars
+        self.chunk_chars = chunk_chars
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.completions = 0
+        self.errors = 0
+        self.url = None
+        self._runner = None
+
+    def answer(self, messages):
+        question = messages[-1]["content"] if messages else ""
+        text = f"You asked: {question}. "
+        filler = "The quick brown fox jumps over the lazy dog. "
+        while len(text) < self.response_chars:
+            text += filler
+        return text[:self.response_chars]
+
+    @staticmethod
+    def usage(messages, text):
+        prompt_tokens = sum(len(message["content"]) for message in messages) // 4 + 1
+        completion_tokens = len(text) // 4 + 1
+        # Pretend the system prompt is always served from DeepSeek's prefix cache
+        cached = len(messages[0]["content"]) // 4 if messages and messages[0]["role"] == "system" else 0
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_cache_hit_tokens": cached,
+            "prompt_cache_miss_tokens": prompt_tokens - cached,
+        }
+
+    @staticmethod
+    def error(status, message):
+        body = {"error": {"message": message, "type": "fake_error", "code": status}}
+        return web.json_response(body, status=status)
+
+    def _rejected(self, request):
+        return request.headers.get("Authorization", "").startswith("Bearer sk-bad")
+
+    async def models(self, request):
+        if self._rejected(request):
+            return self.error(401, "Unauthorized: invalid API key")
+        data = [
+            {"id": model, "object": "model", "owned_by": "deepseek"}
+            for model in ("deepseek-chat", "deepseek-reasoner")
+        ]
+        return web.json_response({"object": "list", "data": data})
+
+    async def chat_completions(self, request):
+        if self._rejected(request):
+            return self.error(401, "Unauthorized: invalid API key")
+        body = await request.json()
+        self.completions += 1
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors += 1
+            await asyncio.sleep(self.latency)
+            return self.error(self.error_status, "Injected failure")
+
+        model = body.get("model", "deepseek-chat")
+        messages = body.get("messages", [])
+        text = self.answer(messages)
+        usage = self.usage(messages, text)
+        created = int(time.time())
+
+        if not body.get("stream"):
+            await asyncio.sleep(self.latency)
+            return web.json_response({
+                "id": f"fake-{self.completions}",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(delta, finish_reason=None, usage=None):
+            chunk = {
+                "id": f"fake-{self.completions}",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [] if delta is None else [
+                    {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                ],
+            }
+            if usage is not None:
+                chunk["usage"] = usage
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        await asyncio.sleep(self.latency)
+        if model == "deepseek-reasoner":
+            for _ in range(3):
+                await send({"role": "assistant", "content": None, "reasoning_content": "Hmm. "})
+                await asyncio.sleep(self.token_interval)
+        for start in range(0, len(text), self.chunk_chars):
+            await send({"content": text[start:start + self.chunk_chars]})
+            if self.token_interval:
+                await asyncio.sleep(self.token_interval)
+        await send({}, finish_reason="stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send(None, usage=usage)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start serving; port 0 picks a free port. Returns the base URL."""
+        app = web.Application()
+        app.router.add_post("/chat/completions", self.chat_completions)
+        app.router.add_get("/models", self.models)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds before the first token")
+    parser.add_argument("--token-interval", type=float, default=0.005, help="seconds between streamed chunks")
+    parser.add_argument("--response-chars", type=int, default=600)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    args = parser.parse_args()
+
+    server = FakeDeepSeek(
+        latency=args.latency,
+        token_interval=args.token_interval,
+        response_chars=args.response_chars,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+    )
+    print(f"Fake DeepSeek API on {await server.start(args.host, args.port)}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,161 @@
+"""A local stand-in for a Redis server, speaking enough RESP for RedisSettingsStore.
+
+Usage: python benchmarks/fake_redis.py [--port 6380]
+
+Point the bot at it with SETTINGS_STORE=redis://127.0.0.1:6380/0. Data
+lives in memory and is lost when it exits.
+"""
+import argparse
+import asyncio
+
+
+class FakeRedis:
+    """Serves strings, hashes, sets and MULTI/EXEC from dicts, one database per SELECT index."""
+
+    def __init__(self, password=None):
+        self.password = password
+        self.databases = {}
+        self.commands = 0
+        self.url = None
+        self._server = None
+
+    @staticmethod
+    def encode(reply):
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, Exception):
+            return f"-ERR {reply}\r\n".encode()
+        if isinstance(reply, bool):
+            return b":%d\r\n" % reply
+        if isinstance(reply, int):
+            return b":%d\r\n" % reply
+        if isinstance(reply, str):
+            return f"+{reply}\r\n".encode()
+        if isinstance(reply, bytes):
+            return b"$%d\r\n%s\r\n" % (len(reply), reply)
+        return b"*%d\r\n" % len(reply) + b"".join(FakeRedis.encode(item) for item in reply)
+
+    @staticmethod
+    async def read_command(reader):
+        line = await reader.readuntil(b"\r\n")
+        if not line.startswith(b"*"):
+            # Inline command, e.g. typed into telnet
+            return line.split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int((await reader.readuntil(b"\r\n"))[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    def run(self, data, name, args):
+        if name == "GET":
+            return data.get(args[0])
+        if name == "SET":
+            data[args[0]] = args[1]
+            return "OK"
+        if name == "DEL":
+            return sum(data.pop(key, None) is not None for key in args)
+        if name == "HSET":
+            table = data.setdefault(args[0], {})
+            added = sum(field not in table for field in args[1::2])
+            table.update(zip(args[1::2], args[2::2]))
+            return added
+        if name == "HGET":
+            return data.get(args[0], {}).get(args[1])
+        if name == "HDEL":
+            table = data.get(args[0], {})
+            removed = sum(table.pop(field, None) is not None for field in args[1:])
+            if not table:
+                data.pop(args[0], None)
+            return removed
+        if name == "HGETALL":
+            return [part for item in data.get(args[0], {}).items() for part in item]
+        if name == "SADD":
+            members = data.setdefault(args[0], set())
+            added = len(set(args[1:]) - members)
+            members.update(args[1:])
+            return added
+        if name == "SISMEMBER":
+            return args[1] in data.get(args[0], set())
+        if name == "SMEMBERS":
+            return sorted(data.get(args[0], set()))
+        if name == "FLUSHDB":
+            data.clear()
+            return "OK"
+        return Exception(f"unknown command '{name}'")
+
+    async def handle(self, reader, writer):
+        index = 0
+        authenticated = self.password is None
+        queued = None
+        try:
+            while True:
+                command = await self.read_command(reader)
+                if not command:
+                    continue
+                self.commands += 1
+                name, args = command[0].decode().upper(), command[1:]
+                if name == "AUTH":
+                    authenticated = args[-1].decode() == self.password
+                    reply = "OK" if authenticated else Exception("invalid password")
+                elif not authenticated:
+                    reply = Exception("NOAUTH Authentication required.")
+                elif name == "PING":
+                    reply = "PONG"
+                elif name == "SELECT":
+                    index = int(args[0])
+                    reply = "OK"
+                elif name == "MULTI":
+                    queued = []
+                    reply = "OK"
+                elif name == "EXEC":
+                    data = self.databases.setdefault(index, {})
+                    reply = [self.run(data, queued_name, queued_args) for queued_name, queued_args in queued or []]
+                    queued = None
+                elif queued is not None:
+                    queued.append((name, args))
+                    reply = "QUEUED"
+                else:
+                    reply = self.run(self.databases.setdefault(index, {}), name, args)
+                writer.write(self.encode(reply))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start serving; port 0 picks a free port. Returns a redis:// URL."""
+        self._server = await asyncio.start_server(self.handle, host, port)
+        port = self._server.sockets[0].getsockname()[1]
+        credentials = f":{self.password}@" if self.password else ""
+        self.url = f"redis://{credentials}{host}:{port}/0"
+        return self.url
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6380)
+    parser.add_argument("--password")
+    args = parser.parse_args()
+
+    server = FakeRedis(password=args.password)
+    print(f"Fake Redis on {await server.start(args.host, args.port)}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
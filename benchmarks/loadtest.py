@@ -0,0 +1,336 @@
+"""Drive the bot's mention and /ask handlers offline and report throughput.
+
+Usage: python benchmarks/loadtest.py [--guilds 10,1000] [--concurrency 1,16,64] [--requests 500]
+
+Each scenario builds a fresh bot from create_bot() on a temporary database,
+points it at a local fake DeepSeek server (benchmarks/fake_deepseek.py) and
+feeds it synthetic messages and interactions through a fake Discord
+transport, so no network access or tokens are needed. It reports
+requests/sec, p50/p99 latency, upstream calls and database calls per
+request, and peak Python memory (tracemalloc) per scenario. Tracing
+memory slows the bot down, so compare req/s only between runs that agree
+on --no-trace-memory.
+
+For CI, --json writes the results and --baseline compares against an
+earlier --json file, exiting non-zero when a scenario regresses by more
+than --tolerance.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_deepseek import FakeDeepSeek
+
+_ids = itertools.count(10**17)
+
+
+class FakeUser:
+    def __init__(self, user_id, bot=False):
+        self.id = user_id
+        self.bot = bot
+        self.mention = f"<@{user_id}>"
+
+
+class FakeSentMessage:
+    def __init__(self, transport, content):
+        self.id = next(_ids)
+        self.content = content
+        self._transport = transport
+
+    async def edit(self, content=None, **kwargs):
+        await self._transport.call("edit")
+        self.content = content
+        return self
+
+
+class FakeDiscord:
+    """Counts Discord API calls and makes each one take `latency` seconds."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+
+    async def call(self, action):
+        self.calls[action] = self.calls.get(action, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def send(self, content=None, **kwargs):
+        await self.call("send")
+        return FakeSentMessage(self, content)
+
+
+class _Typing:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeChannel:
+    def __init__(self, transport, channel_id):
+        self.id = channel_id
+        self._transport = transport
+
+    async def send(self, content=None, **kwargs):
+        return await self._transport.send(content, **kwargs)
+
+    def typing(self):
+        return _Typing()
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+
+
+class FakeMessage:
+    def __init__(self, transport, author, guild, channel, content, mentions):
+        self.id = next(_ids)
+        self.author = author
+        self.guild = guild
+        self.channel = channel
+        self.content = content
+        self.mentions = mentions
+        self.reference = None
+        self._transport = transport
+
+    async def reply(self, content=None, **kwargs):
+        return await self._transport.send(content, **kwargs)
+
+
+class FakeInteractionResponse:
+    def __init__(self, transport):
+        self._transport = transport
+
+    async def send_message(self, content=None, **kwargs):
+        await self._transport.call("send")
+
+    async def defer(self, **kwargs):
+        await self._transport.call("defer")
+
+
+class FakeFollowup:
+    def __init__(self, transport):
+        self._transport = transport
+
+    async def send(self, content=None, wait=False, **kwargs):
+        return await self._transport.send(content, **kwargs)
+
+
+class FakeInteraction:
+    def __init__(self, transport, user, guild_id, channel_id):
+        self.user = user
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.response = FakeInteractionResponse(transport)
+        self.followup = FakeFollowup(transport)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run_scenario(args, api_url, guilds, concurrency):
+    from bot import create_bot
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({
+            "DB_PATH": os.path.join(tmp, "bench.db"),
+            "RETRIEVAL_DIR": os.path.join(tmp, "retrieval"),
+            "DEEPSEEK_BASE_URL": api_url,
+            "STREAM_RESPONSES": "0" if args.no_stream else "1",
+            "STREAM_EDIT_INTERVAL": str(args.edit_interval),
+            # Synthetic traffic would only measure the throttle
+            "RATE_LIMIT_USER": "0",
+            "RATE_LIMIT_CHANNEL": "0",
+            "RATE_LIMIT_GUILD": "0",
+        })
+        os.environ.pop("METRICS_PORT", None)
+
+        if args.trace_memory:
+            tracemalloc.start()
+        bot = create_bot()
+        bot._connection.user = FakeUser(next(_ids), bot=True)
+        await bot.setup_hook()
+        try:
+            guild_ids = [next(_ids) for _ in range(guilds)]
+            for guild_id in guild_ids:
+                await bot.db.set_api_key(guild_id, f"sk-bench-{guild_id % 7}")
+            bot.settings.preload(await bot.db.get_all_settings())
+
+            transport = FakeDiscord(args.discord_latency)
+            ask = bot.tree.get_command("ask").callback
+            channels = {
+                guild_id: [FakeChannel(transport, next(_ids)) for _ in range(args.channels)]
+                for guild_id in guild_ids
+            }
+            users = [FakeUser(next(_ids)) for _ in range(args.users)]
+            rng = random.Random(args.seed)
+
+            def make_request(index):
+                guild_id = rng.choice(guild_ids)
+                channel = rng.choice(channels[guild_id])
+                user = rng.choice(users)
+                question = f"Question number {index} about topic {rng.randrange(1000)}"
+                if rng.random() < args.ask_ratio:
+                    interaction = FakeInteraction(transport, user, guild_id, channel.id)
+                    return lambda: ask(interaction, message=question)
+                message = FakeMessage(
+                    transport, user, FakeGuild(guild_id), channel,
+                    f"<@{bot.user.id}> {question}", [bot.user]
+                )
+                return lambda: bot.on_message(message)
+
+            queue = asyncio.Queue()
+            for index in range(args.requests):
+                queue.put_nowait(make_request(index))
+            latencies = []
+
+            async def worker():
+                while not queue.empty():
+                    handler = queue.get_nowait()
+                    started = time.perf_counter()
+                    await handler()
+                    latencies.append(time.perf_counter() - started)
+
+            db_calls_before = bot.metrics.db_latency.count()
+            upstream_before = args.server.completions if args.server else 0
+            if args.trace_memory:
+                tracemalloc.reset_peak()
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+            await bot.db.flush()
+            _, peak = tracemalloc.get_traced_memory() if args.trace_memory else (0, 0)
+
+            db_calls = bot.metrics.db_latency.count() - db_calls_before
+            errors = bot.metrics.errors.total()
+            return {
+                "guilds": guilds,
+                "concurrency": concurrency,
+                "requests": len(latencies),
+                "rps": len(latencies) / elapsed,
+                "p50_ms": percentile(latencies, 0.50) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+                "db_calls_per_request": db_calls / len(latencies),
+                "upstream_per_request": (
+                    (args.server.completions - upstream_before) / len(latencies) if args.server else None
+                ),
+                "discord_calls_per_request": sum(transport.calls.values()) / len(latencies),
+                "errors": errors,
+                "peak_mb": peak / 2**20 if args.trace_memory else None,
+            }
+        finally:
+            if args.trace_memory:
+                tracemalloc.stop()
+            await bot.shutdown()
+
+
+def compare(results, baseline, tolerance):
+    """Return a line for every scenario that got worse than the baseline."""
+    previous = {(row["guilds"], row["concurrency"]): row for row in baseline}
+    regressions = []
+    for row in results:
+        before = previous.get((row["guilds"], row["concurrency"]))
+        if before is None:
+            continue
+        name = f"guilds={row['guilds']} concurrency={row['concurrency']}"
+        if row["rps"] < before["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: {row['rps']:.1f} req/s, was {before['rps']:.1f}")
+        for key in ("p99_ms", "db_calls_per_request", "peak_mb"):
+            if row[key] is None or before[key] is None:
+                continue
+            if row[key] > before[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {row[key]:.2f}, was {before[key]:.2f}")
+    return regressions
+
+
+def int_list(value):
+    return [int(part) for part in value.split(",") if part]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int_list, default=[10, 1000], help="comma-separated guild counts")
+    parser.add_argument("--concurrency", type=int_list, default=[1, 16, 64], help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--channels", type=int, default=3, help="channels per guild")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--ask-ratio", type=float, default=0.5, help="fraction sent as /ask instead of a mention")
+    parser.add_argument("--no-stream", action="store_true", help="benchmark with STREAM_RESPONSES=0")
+    parser.add_argument("--edit-interval", type=float, default=0.05)
+    parser.add_argument("--discord-latency", type=float, default=0.0, help="seconds per fake Discord call")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake API seconds before the first token")
+    parser.add_argument("--token-interval", type=float, default=0.002)
+    parser.add_argument("--response-chars", type=int, default=600)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--no-trace-memory", dest="trace_memory", action="store_false",
+        help="skip tracemalloc, which slows CPU-bound scenarios noticeably"
+    )
+    parser.add_argument("--api-url", help="use an already running fake server instead of starting one")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="fail if results regress against this --json file")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    args.server = None
+    api_url = args.api_url
+    if api_url is None:
+        args.server = FakeDeepSeek(
+            latency=args.latency,
+            token_interval=args.token_interval,
+            response_chars=args.response_chars,
+            error_rate=args.error_rate,
+            seed=args.seed,
+        )
+        api_url = await args.server.start()
+
+    results = []
+    try:
+        print(f"{'guilds':>7} {'conc':>5} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} "
+              f"{'db/req':>7} {'api/req':>7} {'errors':>6} {'peak MB':>8}")
+        for guilds in args.guilds:
+            for concurrency in args.concurrency:
+                row = await run_scenario(args, api_url, guilds, concurrency)
+                results.append(row)
+                upstream = row["upstream_per_request"]
+                print(f"{guilds:>7} {concurrency:>5} {row['rps']:>8.1f} {row['p50_ms']:>8.1f} "
+                      f"{row['p99_ms']:>8.1f} {row['db_calls_per_request']:>7.2f} "
+                      f"{'-' if upstream is None else format(upstream, '.2f'):>7} "
+                      f"{row['errors']:>6} {'-' if row['peak_mb'] is None else format(row['peak_mb'], '.1f'):>8}")
+    finally:
+        if args.server is not None:
+            await args.server.stop()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -2,82 +2,360 @@ import discord
 from discord import app_commands
 from discord.ui import Button, View, Modal, TextInput
 import asyncio
+import hashlib
+import io
+import json
+import math
+import openai
+import signal
+import time
 from database import Database
-from openai import OpenAI
+from storage import parse_store
+from guild_settings import GuildSettings
+from clients import ClientPool, DEEPSEEK_BASE_URL
+from streaming import StreamingReply, stream_completion
+from conversation import ConversationStore, build_messages
+from response_cache import ResponseCache
+from scheduler import RequestScheduler, SchedulerBusy
+from singleflight import SingleFlight
+from ratelimit import RateLimiter, parse_limit
+from metrics import Metrics
+from router import AUTO_MODEL, DEFAULT_KEYWORDS, ModelRouter
+from usage import UsageTracker
+from resilience import CircuitOpen, Resilience, parse_deadlines
+from backends import BackendPool, parse_backends
+from retrieval import RetrievalIndex
+from batch import BatchError, Collected, format_results, parse_prompts, run_batch
 import os
 from dotenv import load_dotenv
 
-class DeepseekBot(discord.Client):
-    def __init__(self):
+SYSTEM_PROMPT = "You are a helpful assistant"
+# Longest system prompt a guild can set with /systemprompt
+MAX_SYSTEM_PROMPT = 4000
+# Discord expires an interaction's token after 15 minutes; a /batch still
+# running by then reports to the channel instead
+INTERACTION_LIFETIME = 14 * 60
+
+def response_file(text):
+    return discord.File(io.BytesIO(text.encode("utf-8")), filename="response.md")
+
+def describe_error(error, model):
+    """Map an API error to a metrics category and a message for the user."""
+    error_message = str(error)
+    user_friendly_error = "There was an error communicating with DeepSeek API. "
+
+    if isinstance(error, CircuitOpen):
+        if error.unauthorized:
+            return "circuit_open", "DeepSeek rejected this server's API key, so requests are paused. Please set a new key with /apikey."
+        return "circuit_open", f"DeepSeek has been failing for this server, so requests are paused. Please try again in {math.ceil(error.retry_after)} seconds."
+    elif isinstance(error, (asyncio.TimeoutError, openai.APITimeoutError)):
+        return "timeout", user_friendly_error + "DeepSeek took too long to answer. Please try again."
+    elif "Unauthorized" in error_message or "unauthorized" in error_message.lower():
+        return "unauthorized", user_friendly_error + "Your API key may be invalid. Please set a new key with /apikey."
+    elif "not found" in error_message.lower() or "404" in error_message:
+        return "model_unavailable", user_friendly_error + f"The model '{model}' may not be available. Try changing models with /model."
+    else:
+        return "api_error", user_friendly_error + f"Error details: {error_message}"
+
+class DeepseekBot(discord.AutoShardedClient):
+    def __init__(self, shard_ids=None, shard_count=None):
         intents = discord.Intents.default()
         intents.message_content = True
-        super().__init__(intents=intents)
+        # One shard unless told otherwise; launcher.py spreads shard groups over processes
+        if shard_count is None:
+            shard_count = os.getenv('SHARD_COUNT', '1')
+            shard_count = None if shard_count == 'auto' else int(shard_count)
+        super().__init__(intents=intents, shard_ids=shard_ids, shard_count=shard_count)
         self.tree = app_commands.CommandTree(self)
-        self.db = Database()
+        # DB_FLUSH_INTERVAL > 0 batches deferred writes into one commit per interval.
+        # SETTINGS_STORE moves guild settings out of DB_PATH: "memory", or a
+        # redis:// URL shared by every host running the bot
+        self.db = Database(
+            os.getenv('DB_PATH', 'bot.db'),
+            flush_interval=float(os.getenv('DB_FLUSH_INTERVAL', '0')),
+            store=parse_store(os.getenv('SETTINGS_STORE', 'sqlite'))
+        )
+        self.metrics = Metrics()
+        self.metrics.instrument(self.db, self.metrics.db_latency)
+        # Reads on the message path are served from here, not from SQLite
+        self.settings = GuildSettings(self.db, max_guilds=int(os.getenv('SETTINGS_CACHE_SIZE', '10000')))
+        # DEEPSEEK_BASE_URL points at another OpenAI-compatible server, e.g. benchmarks/fake_deepseek.py.
+        # API keys are validated against it.
+        base_url = os.getenv('DEEPSEEK_BASE_URL', DEEPSEEK_BASE_URL)
+        self.clients = ClientPool(
+            base_url=base_url,
+            max_connections=int(os.getenv('DEEPSEEK_MAX_CONNECTIONS', '20')),
+            idle_ttl=float(os.getenv('DEEPSEEK_CLIENT_IDLE_TTL', '300')),
+            # Key checks list models with a short timeout and remember the verdict
+            validate_timeout=float(os.getenv('API_KEY_VALIDATION_TIMEOUT', '5')),
+            validate_ttl=float(os.getenv('API_KEY_VALIDATION_TTL', '300'))
+        )
+        # Endpoints completions are spread over, as a JSON list of {"name", "base_url", "models", "api_key"};
+        # just DEEPSEEK_BASE_URL when unset
+        self.backends = BackendPool(
+            parse_backends(os.getenv('DEEPSEEK_BACKENDS'), base_url),
+            failures_to_mark_down=int(os.getenv('BACKEND_FAILURES_TO_MARK_DOWN', '2')),
+            cooldown=float(os.getenv('BACKEND_COOLDOWN', '30'))
+        )
+        # Stream answers into an edited message instead of waiting for the full completion
+        self.stream_responses = os.getenv('STREAM_RESPONSES', '1') != '0'
+        self.stream_edit_interval = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))
+        # Answers longer than this are sent as a single .md attachment
+        self.attach_over = int(os.getenv('ATTACH_RESPONSE_OVER', '6000'))
+        # Recent exchanges per channel sent as history; a budget of 0 turns memory off.
+        # A channel quiet for CONVERSATION_IDLE_TIMEOUT seconds starts over (0 never does)
+        self.conversations = ConversationStore(
+            self.db,
+            token_budget=int(os.getenv('CONVERSATION_TOKEN_BUDGET', '2000')),
+            idle_timeout=float(os.getenv('CONVERSATION_IDLE_TIMEOUT', '1800'))
+        )
+        # Channels that opt in with /memory have their messages indexed and searched for context
+        self.retrieval = RetrievalIndex(
+            self.db,
+            directory=os.getenv('RETRIEVAL_DIR', 'retrieval'),
+            dim=int(os.getenv('RETRIEVAL_DIM', '512')),
+            top_k=int(os.getenv('RETRIEVAL_TOP_K', '5')),
+            token_budget=int(os.getenv('RETRIEVAL_TOKEN_BUDGET', '500'))
+        )
+        # Answers for guilds that opt in with /cache
+        self.responses = ResponseCache(
+            self.db,
+            max_entries=int(os.getenv('RESPONSE_CACHE_SIZE', '5000')),
+            ttl=float(os.getenv('RESPONSE_CACHE_TTL', '3600')),
+            persist=os.getenv('RESPONSE_CACHE_PERSIST', '0') == '1',
+            max_rows=int(os.getenv('RESPONSE_CACHE_MAX_ROWS', '50000'))
+        )
+        # Every DeepSeek call waits here for a slot, shared fairly between guilds
+        self.scheduler = RequestScheduler(
+            max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', '16')),
+            per_guild=int(os.getenv('LLM_MAX_CONCURRENCY_PER_GUILD', '2')),
+            max_queue=int(os.getenv('LLM_MAX_QUEUE', '200')),
+            max_queue_per_guild=int(os.getenv('LLM_MAX_QUEUE_PER_GUILD', '20'))
+        )
+        self.startup_done = False
+        self.metrics.gauge("scheduler_active_requests", "DeepSeek calls holding a slot.", lambda: self.scheduler.stats()["active"])
+        self.metrics.gauge("scheduler_queued_requests", "Requests waiting for a slot.", lambda: self.scheduler.stats()["queued"])
+        self.metrics.gauge("scheduler_wait_seconds_max", "Longest time a request has waited for a slot.", lambda: self.scheduler.max_wait)
+        # Token usage per guild, written to the database every USAGE_FLUSH_INTERVAL seconds
+        self.usage = UsageTracker(self.db, flush_interval=float(os.getenv('USAGE_FLUSH_INTERVAL', '30')))
+        # Guilds on the "auto" model get chat or the reasoner per prompt
+        keywords = os.getenv('AUTO_ROUTE_KEYWORDS')
+        self.router = ModelRouter(
+            long_prompt=int(os.getenv('AUTO_ROUTE_LONG_PROMPT', '600')),
+            threshold=int(os.getenv('AUTO_ROUTE_THRESHOLD', '2')),
+            keywords=keywords.split(",") if keywords else DEFAULT_KEYWORDS,
+            metrics=self.metrics
+        )
+        # Deadlines per model as "MODEL=SECONDS,...", the longest wait for the first token
+        # or between chunks; retries, hedging and per-key circuit breakers
+        self.resilience = Resilience(
+            deadlines=parse_deadlines(os.getenv('LLM_DEADLINES', 'deepseek-chat=60,deepseek-reasoner=300')),
+            default_deadline=float(os.getenv('LLM_DEFAULT_DEADLINE', '120')),
+            max_retries=int(os.getenv('LLM_MAX_RETRIES', '2')),
+            backoff=float(os.getenv('LLM_RETRY_BACKOFF', '0.5')),
+            hedge_after=float(os.getenv('LLM_HEDGE_AFTER', '0')),
+            breaker_failures=int(os.getenv('LLM_BREAKER_FAILURES', '5')),
+            breaker_cooldown=float(os.getenv('LLM_BREAKER_COOLDOWN', '60')),
+            metrics=self.metrics
+        )
+        self.metrics.gauge("circuit_breakers_open", "API keys whose calls are paused.", lambda: self.resilience.stats()["open"])
+        self.metrics.gauge(
+            "backend_latency_seconds", "Moving average of time to first token per backend.",
+            lambda: {(name,): stats["latency"] or 0.0 for name, stats in self.backends.stats().items()},
+            labels=("backend",)
+        )
+        self.metrics.gauge(
+            "backend_healthy", "1 if a backend is taking requests, 0 while it is marked down.",
+            lambda: {(name,): int(stats["healthy"]) for name, stats in self.backends.stats().items()},
+            labels=("backend",)
+        )
+        # /batch runs at most BATCH_CONCURRENCY prompts at once, so a big file
+        # queues here instead of filling the scheduler's queue
+        self.batch_concurrency = int(os.getenv('BATCH_CONCURRENCY', '4'))
+        self.batch_max_prompts = int(os.getenv('BATCH_MAX_PROMPTS', '200'))
+        self.batch_max_bytes = int(os.getenv('BATCH_MAX_BYTES', '262144'))
+        self.batch_progress_interval = float(os.getenv('BATCH_PROGRESS_INTERVAL', '5'))
+        # Guilds with a batch running; one at a time per guild
+        self.batches = set()
+        # Identical requests already in flight share one upstream call
+        self.inflight = SingleFlight()
+        # Token buckets as "COUNT/SECONDS"; "0" disables a scope
+        self.rate_limiter = RateLimiter(
+            user=parse_limit(os.getenv('RATE_LIMIT_USER', '5/60')),
+            channel=parse_limit(os.getenv('RATE_LIMIT_CHANNEL', '20/60')),
+            guild=parse_limit(os.getenv('RATE_LIMIT_GUILD', '60/60'))
+        )
         
     async def setup_hook(self):
         await self.db.init()
-        
+        await self.retrieval.init()
+        # run() only shuts down cleanly on Ctrl+C; docker stop and systemd send
+        # SIGTERM, which would otherwise lose deferred writes and pending usage
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(self.close()))
+        except (NotImplementedError, RuntimeError):
+            # No signal handlers on Windows, or outside the main thread
+            pass
+        # One listening instance per view, shared by every message that shows it
+        self.add_view(SetupView(self))
+        self.add_view(ModelSelect(self))
+        self.clients.start()
+        # Optional Prometheus endpoint, local by default
+        metrics_port = os.getenv('METRICS_PORT')
+        if metrics_port:
+            await self.metrics.start(os.getenv('METRICS_HOST', '127.0.0.1'), int(metrics_port))
+
+    async def close(self):
+        await super().close()
+        await self.shutdown()
+
+    async def shutdown(self):
+        """Stop background work and write out everything still pending, in dependency order."""
+        await self.metrics.stop()
+        await self.clients.close()
+        await self.usage.close()
+        await self.retrieval.close()
+        await self.db.close()
+
+    async def generate(self, guild_id, api_key, model, messages, reply, on_queued=None):
+        """Run a completion and show it through reply, returning the full text.
+
+        Identical requests share one upstream call; only that call waits for
+        a scheduler slot. Raises CircuitOpen straight away while calls with
+        this key are paused.
+        """
+        self.resilience.check(api_key)
+
+        async def produce(flight):
+            async with self.scheduler.slot(guild_id, on_queued=on_queued):
+                started = time.perf_counter()
+                # Backends this request has used, so a retry or hedge goes elsewhere
+                tried = []
+
+                async def attempt(sink):
+                    async def request(backend, on_first_token):
+                        client = self.clients.get(backend.api_key or api_key, backend.base_url)
+                        if self.stream_responses:
+                            def first_token():
+                                on_first_token()
+                                self.metrics.time_to_first_token.observe(time.perf_counter() - started, model)
+
+                            return await stream_completion(client, model, messages, sink, on_first_token=first_token)
+                        response = await client.chat.completions.create(
+                            model=model,
+                            messages=messages,
+                            stream=False
+                        )
+                        await sink.feed(response.choices[0].message.content)
+                        return response.usage
+
+                    return await self.backends.attempt(model, tried, request)
+
+                usage = await self.resilience.call(api_key, model, attempt, flight)
+                elapsed = time.perf_counter() - started
+                self.metrics.llm_latency.observe(elapsed, model)
+                self.router.observe(model, elapsed)
+                self.metrics.record_usage(model, usage)
+                self.usage.record(guild_id, model, usage)
+
+        return await self.inflight.run(SingleFlight.key(api_key, model, messages), produce, reply)
+
     async def on_ready(self):
         print(f'Logged in as {self.user}')
-        
+
+        # on_ready fires again after every gateway reconnect; the startup
+        # work below only needs to happen once per process
+        if self.startup_done:
+            return
+        self.startup_done = True
+
+        # Commands are global, so only the process that owns shard 0 syncs
+        # them. Each guild lives on exactly one shard, so every process only
+        # welcomes its own guilds and no two processes race on one guild.
+        if self.shard_ids is None or 0 in self.shard_ids:
+            await self.sync_commands()
+        await self.send_welcome_messages()
+
+    async def sync_commands(self):
         # Get guild ID from env
         guild_id = os.getenv('GUILD_ID')
+        guild = None
         if guild_id:
             guild = discord.Object(id=int(guild_id))
-            # Sync commands to the specific guild
             self.tree.copy_global_to(guild=guild)
-            await self.tree.sync(guild=guild)
-            print(f"Synced commands to guild ID: {guild_id}")
         else:
             print("No GUILD_ID found in .env, commands may take up to an hour to register globally")
-            await self.tree.sync()
-        
+
+        # Skip the sync when the command definitions match the last synced ones
+        commands = [command.to_dict(self.tree) for command in self.tree.get_commands(guild=guild)]
+        digest = hashlib.sha256(json.dumps(commands, sort_keys=True).encode("utf-8")).hexdigest()
+        state_key = f"command_hash:{self.application_id}:{guild_id or 'global'}"
+        if await self.db.get_state(state_key) == digest:
+            print("Commands unchanged since the last sync, skipping sync")
+            return
+
+        await self.tree.sync(guild=guild)
+        await self.db.set_state(state_key, digest)
+        if guild_id:
+            print(f"Synced commands to guild ID: {guild_id}")
+
+    async def send_welcome_messages(self):
+        # One query for every guild's settings, which also warms the cache
+        rows = await self.db.get_all_settings()
+        self.settings.preload(rows)
+
+        semaphore = asyncio.Semaphore(int(os.getenv('WELCOME_CONCURRENCY', '5')))
+
+        async def welcome(guild):
+            async with semaphore:
+                await self.send_welcome(guild)
+
         # Send setup message to each guild - ONLY FOR NEW GUILDS
+        new_guilds = []
         for guild in self.guilds:
-            # Check if welcome message has been sent already
-            welcome_sent = await self.db.get_welcome_sent(guild.id)
-            if welcome_sent:
-                continue
-                
-            # Try to find a channel named 'general' first
-            target_channel = discord.utils.get(guild.text_channels, name='general')
-            
-            # If no 'general' channel, use the first text channel we can send messages to
-            if not target_channel:
-                for channel in guild.text_channels:
-                    permissions = channel.permissions_for(guild.me)
-                    if permissions.send_messages and permissions.embed_links:
-                        target_channel = channel
-                        break
-            
-            if target_channel:
-                # Check if API key exists for this guild
-                api_key = await self.db.get_api_key(guild.id)
-                if not api_key:
-                    embed = discord.Embed(
-                        title="Welcome to DeepSeek Discord Bot! 🎉",
-                        description=(
-                            "Thank you for adding me to your server!\n\n"
-                            "To get started, please run the `/setup` command to configure:\n"
-                            "• Your DeepSeek API Key\n"
-                            "• Preferred AI Model\n\n"
-                            "Once setup is complete, you can use:\n"
-                            "• `/ask` - Ask questions\n"
-                            "• `/model` - Switch AI models\n"
-                            "• Or just mention me in any message!"
-                        ),
-                        color=discord.Color.blue()
-                    )
-                    embed.set_footer(text="Made with ❤️ by rifts")
-                    
-                    try:
-                        await target_channel.send(embed=embed)
-                        await self.db.set_welcome_sent(guild.id, True)
-                    except discord.Forbidden:
-                        print(f"Cannot send messages in {target_channel.name} in {guild.name}")
-                    except Exception as e:
-                        print(f"Error sending welcome message to {guild.name}: {str(e)}")
+            row = rows.get(guild.id, {})
+            if not row.get("welcome_sent") and not row.get("api_key"):
+                new_guilds.append(guild)
+        await asyncio.gather(*(welcome(guild) for guild in new_guilds))
+
+    async def send_welcome(self, guild):
+        # Try to find a channel named 'general' first
+        target_channel = discord.utils.get(guild.text_channels, name='general')
+
+        # If no 'general' channel, use the first text channel we can send messages to
+        if not target_channel:
+            for channel in guild.text_channels:
+                permissions = channel.permissions_for(guild.me)
+                if permissions.send_messages and permissions.embed_links:
+                    target_channel = channel
+                    break
+
+        if not target_channel:
+            return
+
+        embed = discord.Embed(
+            title="Welcome to DeepSeek Discord Bot! 🎉",
+            description=(
+                "Thank you for adding me to your server!\n\n"
+                "To get started, please run the `/setup` command to configure:\n"
+                "• Your DeepSeek API Key\n"
+                "• Preferred AI Model\n\n"
+                "Once setup is complete, you can use:\n"
+                "• `/ask` - Ask questions\n"
+                "• `/model` - Switch AI models\n"
+                "• Or just mention me in any message!"
+            ),
+            color=discord.Color.blue()
+        )
+        embed.set_footer(text="Made with ❤️ by rifts")
+
+        try:
+            await target_channel.send(embed=embed)
+            await self.settings.set_welcome_sent(guild.id, True, defer=True)
+        except discord.Forbidden:
+            print(f"Cannot send messages in {target_channel.name} in {guild.name}")
+        except Exception as e:
+            print(f"Error sending welcome message to {guild.name}: {str(e)}")
 
 class APIKeyModal(Modal):
     def __init__(self, bot):
@@ -96,55 +374,56 @@ class APIKeyModal(Modal):
         
         try:
             # Test the API key first before saving
-            client = OpenAI(
-                api_key=self.api_key.value,
-                base_url="https://api.deepseek.com"
-            )
-            
-            response = await asyncio.to_thread(
-                lambda: client.chat.completions.create(
-                    model="deepseek-chat",
-                    messages=[
-                        {"role": "system", "content": "You are a helpful assistant"},
-                        {"role": "user", "content": "You are a discord bot that will answer questions."},
-                    ],
-                    stream=False
-                )
-            )
-            
+            error = await self.bot.clients.validate(self.api_key.value)
+            if error is not None:
+                await interaction.followup.send(f"Error testing API key: {error}", ephemeral=True)
+                return
+            self.bot.resilience.reset(self.api_key.value)
+
             # Only save API key if test was successful
-            await self.bot.db.set_api_key(interaction.guild_id, self.api_key.value)
+            await self.bot.settings.set_api_key(interaction.guild_id, self.api_key.value)
             
             # Set default model if not already set
-            current_model = await self.bot.db.get_model(interaction.guild_id)
+            current_model = await self.bot.settings.get_model(interaction.guild_id)
             if not current_model:
-                await self.bot.db.set_model(interaction.guild_id, "deepseek-chat")
+                await self.bot.settings.set_model(interaction.guild_id, "deepseek-chat")
                 
             await interaction.followup.send("API key has been set successfully! You can now use /ask or mention me to chat.", ephemeral=True)
             
             # Update the setup view if this was from setup
             try:
-                await interaction.message.edit(view=SetupView(self.bot, True))
+                await interaction.message.edit(view=detached(SetupView(self.bot, True)))
             except:
                 pass
                 
         except Exception as e:
             await interaction.followup.send(f"Error testing API key: {str(e)}", ephemeral=True)
 
+def detached(view):
+    """Stop a view before sending it, so discord.py doesn't keep a copy per message.
+
+    Only the layout is sent; clicks are matched by custom_id to the one
+    instance of each view registered in setup_hook.
+    """
+    view.stop()
+    return view
+
 class SetupView(View):
+    """The /setup buttons, registered once as a persistent view."""
+
     def __init__(self, bot, api_key_set=False):
-        super().__init__(timeout=None)  # Set timeout to None to keep buttons active
+        super().__init__(timeout=None)
         self.bot = bot
         self.api_key_set = api_key_set
         self.update_buttons()
 
-    @discord.ui.button(label="Set API Key", style=discord.ButtonStyle.primary)
+    @discord.ui.button(label="Set API Key", style=discord.ButtonStyle.primary, custom_id="deepseek:setup:api_key")
     async def set_key(self, interaction: discord.Interaction, button: Button):
         await interaction.response.send_modal(APIKeyModal(self.bot))
 
-    @discord.ui.button(label="Select Model", style=discord.ButtonStyle.secondary)
+    @discord.ui.button(label="Select Model", style=discord.ButtonStyle.secondary, custom_id="deepseek:setup:model")
     async def select_model(self, interaction: discord.Interaction, button: Button):
-        api_key = await self.bot.db.get_api_key(interaction.guild_id)
+        api_key = await self.bot.settings.get_api_key(interaction.guild_id)
         if not api_key:
             await interaction.response.send_message("Please set an API key first!", ephemeral=True)
             return
@@ -152,61 +431,60 @@ class SetupView(View):
         # Get the command and execute it
         try:
             command = self.bot.tree.get_command("model")
-            await interaction.response.defer(ephemeral=True)
             await command.callback(interaction)
         except Exception as e:
-            await interaction.followup.send(f"Error: {str(e)}", ephemeral=True)
+            print(f"Error opening model selection: {str(e)}")
     
     def update_buttons(self):
         self.select_model.disabled = not self.api_key_set
         return self
 
 class ModelSelect(View):
-    def __init__(self, bot, current_model):
-        super().__init__(timeout=None)  # Set timeout to None to keep buttons active
+    """The /model buttons, registered once as a persistent view.
+
+    current_model only decides which button is shown as selected; the
+    registered instance reads and writes the guild's model when clicked.
+    """
+
+    MODELS = (
+        ("deepseek-chat", "DeepSeek Chat (Normal)"),
+        ("deepseek-reasoner", "DeepSeek R1 (Reasoning)"),
+        (AUTO_MODEL, "Auto (Chat or R1 per question)"),
+    )
+
+    def __init__(self, bot, current_model=None):
+        super().__init__(timeout=None)
         self.bot = bot
         
-        # Default to deepseek-chat if current_model is None
-        if not current_model:
-            current_model = "deepseek-chat"
-        
-        chat_button = Button(
-            label=f"{'[SELECTED] ' if current_model == 'deepseek-chat' else ''}DeepSeek Chat (Normal)",
-            style=discord.ButtonStyle.green if current_model == 'deepseek-chat' else discord.ButtonStyle.grey,
-            custom_id="deepseek-chat"
-        )
-        
-        reason_button = Button(
-            label=f"{'[SELECTED] ' if current_model == 'deepseek-reasoner' else ''}DeepSeek R1 (Reasoning)",
-            style=discord.ButtonStyle.green if current_model == 'deepseek-reasoner' else discord.ButtonStyle.grey,
-            custom_id="deepseek-reasoner"
-        )
-        
-        chat_button.callback = self.button_callback
-        reason_button.callback = self.button_callback
-        
-        self.add_item(chat_button)
-        self.add_item(reason_button)
+        for model, label in self.MODELS:
+            button = Button(
+                label=f"{'[SELECTED] ' if current_model == model else ''}{label}",
+                style=discord.ButtonStyle.green if current_model == model else discord.ButtonStyle.grey,
+                custom_id=f"deepseek:model:{model}"
+            )
+            button.callback = self.button_callback
+            self.add_item(button)
 
-    async def button_callback(self, interaction: discord.Interaction):
-        model = interaction.data["custom_id"]
-        await self.bot.db.set_model(interaction.guild_id, model)
-        await interaction.response.send_message(f"Model changed to {model}", ephemeral=True)
-        
-        # Update the embed
-        embed = discord.Embed(
+    @staticmethod
+    def embed():
+        return discord.Embed(
             title="DeepSeek Model Selection",
             description="Select which model you'd like to use:",
             color=discord.Color.blue()
         )
-        
-        await interaction.message.edit(
-            embed=embed,
-            view=ModelSelect(self.bot, model)
+
+    async def button_callback(self, interaction: discord.Interaction):
+        model = interaction.data["custom_id"].rsplit(":", 1)[1]
+        await self.bot.settings.set_model(interaction.guild_id, model)
+        # Redraw the buttons on the message that was clicked, wherever it is
+        await interaction.response.edit_message(
+            embed=self.embed(),
+            view=detached(ModelSelect(self.bot, model))
         )
+        await interaction.followup.send(f"Model changed to {model}", ephemeral=True)
 
-def create_bot():
-    bot = DeepseekBot()
+def create_bot(shard_ids=None, shard_count=None):
+    bot = DeepseekBot(shard_ids=shard_ids, shard_count=shard_count)
     
     @bot.tree.command(name="setup", description="Initial setup for the DeepSeek bot")
     async def setup(interaction: discord.Interaction):
@@ -216,17 +494,21 @@ def create_bot():
                        "Available commands:\n"
                        "• /ask - Ask DeepSeek a question\n"
                        "• /model - Select which DeepSeek model to use\n"
+                       "• /systemprompt - Customize the bot's instructions for this server\n"
+                       "• /usage - Show token usage for this server\n"
+                       "• /memory - Let me search this channel's messages when answering\n"
+                       "• /batch - Answer every question in an attached file\n"
                        "• /apikey - Change your API key\n\n"
                        "To get started, click 'Set API Key' below and enter your DeepSeek API key.",
             color=discord.Color.blue()
         )
         
-        api_key = await bot.db.get_api_key(interaction.guild_id)
-        await interaction.response.send_message(embed=embed, view=SetupView(bot, api_key is not None))
+        api_key = await bot.settings.get_api_key(interaction.guild_id)
+        await interaction.response.send_message(embed=embed, view=detached(SetupView(bot, api_key is not None)))
 
     @bot.tree.command(name="model", description="Select which DeepSeek model to use")
     async def model(interaction: discord.Interaction):
-        api_key = await bot.db.get_api_key(interaction.guild_id)
+        api_key = await bot.settings.get_api_key(interaction.guild_id)
         if not api_key:
             embed = discord.Embed(
                 title="Setup Required",
@@ -236,45 +518,25 @@ def create_bot():
             await interaction.response.send_message(embed=embed, ephemeral=True)
             return
 
-        # Delete previous model message if it exists
-        try:
-            message_id, channel_id = await bot.db.get_model_message(interaction.guild_id)
-            if message_id and channel_id:
-                channel = bot.get_channel(channel_id)
-                if channel:
-                    try:
-                        message = await channel.fetch_message(message_id)
-                        await message.delete()
-                    except discord.NotFound:
-                        # Message already deleted, continue
-                        pass
-                    except Exception as e:
-                        print(f"Error deleting previous model message: {str(e)}")
-        except Exception as e:
-            print(f"Error handling previous model message: {str(e)}")
-
-        current_model = await bot.db.get_model(interaction.guild_id)
-        embed = discord.Embed(
-            title="DeepSeek Model Selection",
-            description="Select which model you'd like to use:",
-            color=discord.Color.blue()
-        )
-        
+        current_model = await bot.settings.get_model(interaction.guild_id)
         await interaction.response.send_message(
-            embed=embed,
-            view=ModelSelect(bot, current_model)
+            embed=ModelSelect.embed(),
+            view=detached(ModelSelect(bot, current_model or "deepseek-chat"))
         )
-        
-        # Store the new message details
-        try:
-            message = await interaction.original_response()
-            await bot.db.update_model_message(interaction.guild_id, message.id, interaction.channel_id)
-        except Exception as e:
-            print(f"Error updating model message: {str(e)}")
 
     @bot.tree.command(name="ask", description="Ask DeepSeek a question")
     async def ask(interaction: discord.Interaction, message: str):
-        api_key = await bot.db.get_api_key(interaction.guild_id)
+        bot.metrics.requests.inc("ask")
+        retry_after = bot.rate_limiter.check(interaction.user.id, interaction.channel_id, interaction.guild_id)
+        if retry_after:
+            bot.metrics.errors.inc("rate_limited")
+            await interaction.response.send_message(
+                f"You're sending requests too quickly. Please try again in {math.ceil(retry_after)} seconds.",
+                ephemeral=True
+            )
+            return
+
+        api_key = await bot.settings.get_api_key(interaction.guild_id)
         if not api_key:
             embed = discord.Embed(
                 title="Setup Required",
@@ -286,51 +548,283 @@ def create_bot():
 
         await interaction.response.defer()
 
-        model = await bot.db.get_model(interaction.guild_id)
+        model = await bot.settings.get_model(interaction.guild_id)
         if not model:
             # Set default model if not set
             model = "deepseek-chat"
-            await bot.db.set_model(interaction.guild_id, model)
-            
-        client = OpenAI(api_key=api_key, base_url="https://api.deepseek.com")
+            await bot.settings.set_model(interaction.guild_id, model, defer=True)
+        if model == AUTO_MODEL:
+            model = bot.router.route(message)
+
+        system_prompt = await bot.settings.get_system_prompt(interaction.guild_id) or SYSTEM_PROMPT
+        conversation_id = await bot.conversations.resolve(interaction.channel_id)
+        context = None
+        if bot.retrieval.enabled(interaction.channel_id):
+            context = await bot.retrieval.search(interaction.guild_id, interaction.channel_id, message)
+        history = await bot.conversations.history(conversation_id)
+        messages = build_messages(system_prompt, history, message, context)
 
         try:
-            response = await asyncio.to_thread(
-                lambda: client.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": "You are a helpful assistant"},
-                        {"role": "user", "content": message},
-                    ],
-                    stream=False
-                )
+            async def send_file(note, text, first):
+                return await interaction.followup.send(note, file=response_file(text), wait=True)
+
+            reply = StreamingReply(
+                lambda text: interaction.followup.send(text, wait=True),
+                lambda text, first: interaction.followup.send(text, wait=True),
+                send_file,
+                edit_interval=bot.stream_edit_interval,
+                attach_over=bot.attach_over,
+                observe=bot.metrics.observe_discord
             )
-            
-            # Split long responses if needed
-            content = response.choices[0].message.content
-            if len(content) > 2000:
-                chunks = [content[i:i+1900] for i in range(0, len(content), 1900)]
-                for i, chunk in enumerate(chunks):
-                    if i == 0:
-                        await interaction.followup.send(chunk)
-                    else:
-                        await interaction.followup.send(f"(continued) {chunk}")
+
+            # Guilds that opt in get repeated questions answered without an API call.
+            # The cache is keyed on the question alone, so only questions sent
+            # without history or retrieved messages can use it; a channel's
+            # history lapses after CONVERSATION_IDLE_TIMEOUT
+            use_cache = not history and not context and await bot.settings.get_response_cache(interaction.guild_id)
+            cached = None
+            if use_cache:
+                cached = await bot.responses.get(interaction.guild_id, model, system_prompt, message)
+
+            async def notify_queued(position):
+                await interaction.followup.send(f"The bot is busy right now, you're queued at position {position}...")
+
+            if cached is not None:
+                await reply.feed(cached)
+                content = await reply.finish()
             else:
-                await interaction.followup.send(content)
+                content = await bot.generate(interaction.guild_id, api_key, model, messages, reply, on_queued=notify_queued)
+
+            if use_cache and cached is None:
+                await bot.responses.put(interaction.guild_id, model, system_prompt, message, content)
+
+            first_message = reply.messages[0]
+            await bot.conversations.record(conversation_id, interaction.guild_id, message, content, first_message.id)
+
+        except SchedulerBusy:
+            bot.metrics.errors.inc("busy")
+            await interaction.followup.send("The bot is too busy right now. Please try again in a minute.")
                 
         except Exception as e:
-            error_message = str(e)
-            user_friendly_error = "There was an error communicating with DeepSeek API. "
-            
-            if "Unauthorized" in error_message or "unauthorized" in error_message.lower():
-                user_friendly_error += "Your API key may be invalid. Please set a new key with /apikey."
-            elif "not found" in error_message.lower() or "404" in error_message:
-                user_friendly_error += f"The model '{model}' may not be available. Try changing models with /model."
-            else:
-                user_friendly_error += f"Error details: {error_message}"
-                
+            category, user_friendly_error = describe_error(e, model)
+            bot.metrics.errors.inc(category)
             await interaction.followup.send(user_friendly_error)
 
+    @bot.tree.command(name="batch", description="Ask DeepSeek every question in a text or JSONL file")
+    @app_commands.describe(file="A .txt file with one question per line, or .jsonl with a \"prompt\" per line")
+    @app_commands.default_permissions(manage_messages=True)
+    async def batch(interaction: discord.Interaction, file: discord.Attachment):
+        bot.metrics.requests.inc("batch")
+        # The whole batch counts as one request; BATCH_CONCURRENCY and the
+        # one-batch-per-server rule bound what it can cost
+        retry_after = bot.rate_limiter.check(interaction.user.id, interaction.channel_id, interaction.guild_id)
+        if retry_after:
+            bot.metrics.errors.inc("rate_limited")
+            await interaction.response.send_message(
+                f"You're sending requests too quickly. Please try again in {math.ceil(retry_after)} seconds.",
+                ephemeral=True
+            )
+            return
+
+        api_key = await bot.settings.get_api_key(interaction.guild_id)
+        if not api_key:
+            embed = discord.Embed(
+                title="Setup Required",
+                description="Please run /setup first and set your API key!",
+                color=discord.Color.red()
+            )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+            return
+        if interaction.guild_id in bot.batches:
+            await interaction.response.send_message("A batch is already running for this server. Please wait for it to finish.", ephemeral=True)
+            return
+        if file.size > bot.batch_max_bytes:
+            await interaction.response.send_message(f"The file can be at most {bot.batch_max_bytes // 1024} KB.", ephemeral=True)
+            return
+
+        try:
+            prompts = parse_prompts(file.filename, await file.read(), bot.batch_max_prompts)
+        except BatchError as e:
+            await interaction.response.send_message(str(e), ephemeral=True)
+            return
+
+        bot.batches.add(interaction.guild_id)
+        expires = time.monotonic() + INTERACTION_LIFETIME
+        # Posted in the channel once the interaction is about to expire, and edited from then on
+        status = None
+
+        async def show(content):
+            nonlocal status
+            if status is not None:
+                await status.edit(content=content)
+            elif time.monotonic() < expires:
+                await interaction.edit_original_response(content=content)
+            else:
+                status = await interaction.channel.send(content)
+
+        async def send(content=None, **kwargs):
+            if time.monotonic() < expires:
+                await interaction.followup.send(content, **kwargs)
+            else:
+                await interaction.channel.send(f"{interaction.user.mention} {content or ''}".rstrip(), **kwargs)
+
+        try:
+            await interaction.response.send_message(f"Answering {len(prompts)} questions...")
+            model = await bot.settings.get_model(interaction.guild_id) or "deepseek-chat"
+            system_prompt = await bot.settings.get_system_prompt(interaction.guild_id) or SYSTEM_PROMPT
+            use_cache = await bot.settings.get_response_cache(interaction.guild_id)
+
+            async def answer(prompt):
+                prompt_model = bot.router.route(prompt) if model == AUTO_MODEL else model
+                if use_cache:
+                    cached = await bot.responses.get(interaction.guild_id, prompt_model, system_prompt, prompt)
+                    if cached is not None:
+                        return prompt_model, cached
+                # Each question stands alone: no channel history or retrieved messages
+                messages = build_messages(system_prompt, [], prompt)
+                content = await bot.generate(interaction.guild_id, api_key, prompt_model, messages, Collected())
+                if use_cache:
+                    await bot.responses.put(interaction.guild_id, prompt_model, system_prompt, prompt, content)
+                return prompt_model, content
+
+            def describe(error):
+                if isinstance(error, SchedulerBusy):
+                    category, message = "busy", "The bot was too busy to answer this question."
+                else:
+                    category, message = describe_error(error, model)
+                bot.metrics.errors.inc(category)
+                return message
+
+            async def progress(done, failed):
+                failures = f", {failed} failed" if failed else ""
+                await show(f"Answering {len(prompts)} questions... {done}/{len(prompts)} done{failures}")
+
+            started = time.perf_counter()
+            results = await run_batch(
+                prompts, answer, bot.batch_concurrency,
+                on_progress=progress, progress_interval=bot.batch_progress_interval, describe=describe
+            )
+            failed = sum(1 for result in results if "error" in result)
+            jsonl = file.filename.lower().endswith((".jsonl", ".json"))
+            results_file = discord.File(
+                io.BytesIO(format_results(results, jsonl).encode("utf-8")),
+                filename="results.jsonl" if jsonl else "results.md"
+            )
+            summary = f"Answered {len(prompts) - failed}/{len(prompts)} questions in {time.perf_counter() - started:.0f}s."
+            if failed:
+                summary += f" {failed} failed; see the results file for details."
+            await show(summary)
+            await send(file=results_file)
+        except Exception as e:
+            print(f"Error running batch: {str(e)}")
+            await send("The batch could not be completed. Please try again.")
+        finally:
+            bot.batches.discard(interaction.guild_id)
+
+    @bot.tree.command(name="cache", description="Turn caching of repeated questions on or off")
+    async def cache(interaction: discord.Interaction, enabled: bool):
+        await bot.settings.set_response_cache(interaction.guild_id, enabled)
+        state = "enabled" if enabled else "disabled"
+        await interaction.response.send_message(f"Response caching has been {state} for this server.", ephemeral=True)
+
+    @bot.tree.command(name="memory", description="Let the bot search this channel's messages when answering")
+    @app_commands.default_permissions(manage_guild=True)
+    async def memory(interaction: discord.Interaction, enabled: bool):
+        await bot.retrieval.set_enabled(interaction.guild_id, interaction.channel_id, enabled)
+        if enabled:
+            message = "I'll remember messages posted in this channel from now on and use them to answer questions here."
+        else:
+            message = "I'll stop remembering messages in this channel."
+        await interaction.response.send_message(message, ephemeral=True)
+
+    @bot.tree.command(name="stats", description="Show DeepSeek bot cache statistics")
+    async def stats(interaction: discord.Interaction):
+        guild_stats = bot.responses.stats(interaction.guild_id)
+        overall = bot.responses.stats()
+        settings_stats = bot.settings.stats()
+        enabled = await bot.settings.get_response_cache(interaction.guild_id)
+
+        embed = discord.Embed(title="DeepSeek Bot Statistics", color=discord.Color.blue())
+        embed.add_field(
+            name="Response cache (this server)",
+            value=(
+                f"{'Enabled' if enabled else 'Disabled'}\n"
+                f"Hit rate: {guild_stats['hit_rate']:.1%} "
+                f"({guild_stats['hits']} hits / {guild_stats['misses']} misses)"
+            ),
+            inline=False
+        )
+        embed.add_field(
+            name="Response cache (all servers)",
+            value=f"Hit rate: {overall['hit_rate']:.1%}, {overall['size']} entries",
+            inline=False
+        )
+        scheduler_stats = bot.scheduler.stats()
+        embed.add_field(
+            name="Request queue",
+            value=(
+                f"{scheduler_stats['active']} running, {scheduler_stats['queued']} waiting, "
+                f"{scheduler_stats['rejected']} rejected\n"
+                f"Wait: {scheduler_stats['avg_wait']:.2f}s average, {scheduler_stats['max_wait']:.2f}s max\n"
+                f"{bot.inflight.stats()['shared']} requests shared an identical in-flight call"
+            ),
+            inline=False
+        )
+        route_stats = bot.router.stats()
+        embed.add_field(
+            name="Auto model routing",
+            value=(
+                f"{route_stats['chat']} to chat, {route_stats['reasoner']} to reasoner, "
+                f"~{route_stats['saved_seconds']:.0f}s saved"
+            ),
+            inline=False
+        )
+        embed.add_field(
+            name="Settings cache",
+            value=f"Hit rate: {settings_stats['hit_rate']:.1%}, {settings_stats['size']} servers",
+            inline=False
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @bot.tree.command(name="systemprompt", description="Set the system prompt for this server, or reset it")
+    @app_commands.describe(prompt="Instructions given to DeepSeek before every question; leave empty to reset")
+    @app_commands.default_permissions(manage_guild=True)
+    async def systemprompt(interaction: discord.Interaction, prompt: str = None):
+        # Stored stripped so every request carries exactly the same prefix
+        prompt = prompt.strip() if prompt else None
+        if prompt and len(prompt) > MAX_SYSTEM_PROMPT:
+            await interaction.response.send_message(
+                f"The system prompt can be at most {MAX_SYSTEM_PROMPT} characters.", ephemeral=True
+            )
+            return
+        await bot.settings.set_system_prompt(interaction.guild_id, prompt or None)
+        if prompt:
+            await interaction.response.send_message("The system prompt for this server has been updated.", ephemeral=True)
+        else:
+            await interaction.response.send_message("The system prompt has been reset to the default.", ephemeral=True)
+
+    @bot.tree.command(name="usage", description="Show DeepSeek token usage for this server")
+    async def usage(interaction: discord.Interaction):
+        totals = await bot.usage.get(interaction.guild_id)
+        embed = discord.Embed(title="DeepSeek Usage", color=discord.Color.blue())
+        if not totals:
+            embed.description = "No usage recorded for this server yet."
+        for model_name, row in sorted(totals.items()):
+            cached = row["prompt_cache_hit_tokens"] + row["prompt_cache_miss_tokens"]
+            hit_rate = row["prompt_cache_hit_tokens"] / cached if cached else 0.0
+            embed.add_field(
+                name=model_name,
+                value=(
+                    f"{row['requests']:,} requests\n"
+                    f"Prompt tokens: {row['prompt_tokens']:,} "
+                    f"({row['prompt_cache_hit_tokens']:,} cache hits, {row['prompt_cache_miss_tokens']:,} misses, "
+                    f"{hit_rate:.1%} hit rate)\n"
+                    f"Completion tokens: {row['completion_tokens']:,}"
+                ),
+                inline=False
+            )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
     @bot.tree.command(name="apikey", description="Change your DeepSeek API key")
     async def apikey(interaction: discord.Interaction):
         embed = discord.Embed(
@@ -339,24 +833,44 @@ def create_bot():
             color=discord.Color.blue()
         )
         
-        api_key = await bot.db.get_api_key(interaction.guild_id)
-        await interaction.response.send_message(embed=embed, view=SetupView(bot, api_key is not None), ephemeral=True)
+        api_key = await bot.settings.get_api_key(interaction.guild_id)
+        await interaction.response.send_message(embed=embed, view=detached(SetupView(bot, api_key is not None)), ephemeral=True)
 
     @bot.event
     async def on_message(message):
         if message.author.bot:
             return
 
-        # Improved mention check logic
-        is_mentioned = False
-        if bot.user.id in [mention.id for mention in message.mentions]:
+        # Channels with /memory on remember every message, not just questions
+        if message.guild and bot.retrieval.enabled(message.channel.id):
+            bot.retrieval.add(message.guild.id, message.channel.id, message.id, message.author.display_name, message.clean_content)
+
+        # Improved mention check logic. A reply to a deleted message resolves to
+        # a DeletedReferencedMessage, which has no author or mentions
+        referenced = message.reference.resolved if message.reference else None
+        if isinstance(referenced, discord.DeletedReferencedMessage):
+            referenced = None
+        # Replying to one of our answers continues it, with or without the ping
+        replied_to_bot = referenced is not None and referenced.author.id == bot.user.id
+        is_mentioned = replied_to_bot
+        if not is_mentioned and bot.user.id in [mention.id for mention in message.mentions]:
             # Make sure it's not a reply to someone else that happens to mention the bot
-            if not message.reference or not message.reference.resolved or bot.user.id in [mention.id for mention in message.reference.resolved.mentions]:
+            if referenced is None or bot.user.id in [mention.id for mention in referenced.mentions]:
                 is_mentioned = True
         
         if is_mentioned:
+            bot.metrics.requests.inc("mention")
+            # Throttle before touching the database or the API
+            retry_after = bot.rate_limiter.check(message.author.id, message.channel.id, message.guild.id)
+            if retry_after:
+                bot.metrics.errors.inc("rate_limited")
+                # Tell the user once per cooldown instead of on every message
+                if bot.rate_limiter.should_notify(message.author.id, retry_after):
+                    await message.reply(f"You're sending messages too quickly. Please try again in {math.ceil(retry_after)} seconds.")
+                return
+
             # Get API key and check if setup is complete
-            api_key = await bot.db.get_api_key(message.guild.id)
+            api_key = await bot.settings.get_api_key(message.guild.id)
             if not api_key:
                 # More helpful error message with button to run setup
                 embed = discord.Embed(
@@ -383,10 +897,10 @@ def create_bot():
                 return
 
             # Get model, defaulting to deepseek-chat if not set
-            model = await bot.db.get_model(message.guild.id)
+            model = await bot.settings.get_model(message.guild.id)
             if not model:
                 model = "deepseek-chat"
-                await bot.db.set_model(message.guild.id, model)
+                await bot.settings.set_model(message.guild.id, model, defer=True)
 
             # Remove the bot mention from the message
             content = message.content
@@ -401,42 +915,66 @@ def create_bot():
                 await message.reply("How can I help you today?")
                 return
 
+            if model == AUTO_MODEL:
+                model = bot.router.route(content)
+
             # Show typing indicator
             async with message.channel.typing():
                 try:
-                    client = OpenAI(api_key=api_key, base_url="https://api.deepseek.com")
-                    response = await asyncio.to_thread(
-                        lambda: client.chat.completions.create(
-                            model=model,
-                            messages=[
-                                {"role": "system", "content": "You are a helpful assistant"},
-                                {"role": "user", "content": content},
-                            ],
-                            stream=False
-                        )
+                    # A reply to one of our answers continues that answer's conversation
+                    reference_id = referenced.id if replied_to_bot else None
+                    conversation_id = await bot.conversations.resolve(message.channel.id, reference_id)
+
+                    system_prompt = await bot.settings.get_system_prompt(message.guild.id) or SYSTEM_PROMPT
+                    context = None
+                    if bot.retrieval.enabled(message.channel.id):
+                        context = await bot.retrieval.search(message.guild.id, message.channel.id, content, exclude_message_id=message.id)
+                    history = await bot.conversations.history(conversation_id)
+                    messages = build_messages(system_prompt, history, content, context)
+
+                    async def send_file(note, text, first):
+                        if first is None:
+                            return await message.reply(note, file=response_file(text))
+                        return await message.channel.send(note, file=response_file(text), reference=first)
+
+                    reply = StreamingReply(
+                        message.reply,
+                        lambda text, first: message.channel.send(text, reference=first),
+                        send_file,
+                        edit_interval=bot.stream_edit_interval,
+                        attach_over=bot.attach_over,
+                        observe=bot.metrics.observe_discord
                     )
-                    
-                    # Handle long responses
-                    reply_content = response.choices[0].message.content
-                    if len(reply_content) > 2000:
-                        chunks = [reply_content[i:i+1900] for i in range(0, len(reply_content), 1900)]
-                        first_message = await message.reply(chunks[0])
-                        for chunk in chunks[1:]:
-                            await message.channel.send(f"(continued) {chunk}", reference=first_message)
+
+                    # The cache is keyed on the question alone, so only questions sent
+                    # without history or retrieved messages can use it
+                    use_cache = not history and not context and await bot.settings.get_response_cache(message.guild.id)
+                    cached = None
+                    if use_cache:
+                        cached = await bot.responses.get(message.guild.id, model, system_prompt, content)
+
+                    async def notify_queued(position):
+                        await message.reply(f"The bot is busy right now, you're queued at position {position}...")
+
+                    if cached is not None:
+                        await reply.feed(cached)
+                        reply_content = await reply.finish()
                     else:
-                        await message.reply(reply_content)
+                        reply_content = await bot.generate(message.guild.id, api_key, model, messages, reply, on_queued=notify_queued)
+
+                    if use_cache and cached is None:
+                        await bot.responses.put(message.guild.id, model, system_prompt, content, reply_content)
+
+                    first_message = reply.messages[0]
+                    await bot.conversations.record(conversation_id, message.guild.id, content, reply_content, first_message.id)
+
+                except SchedulerBusy:
+                    bot.metrics.errors.inc("busy")
+                    await message.reply("The bot is too busy right now. Please try again in a minute.")
                         
                 except Exception as e:
-                    error_message = str(e)
-                    user_friendly_error = "There was an error communicating with DeepSeek API. "
-                    
-                    if "Unauthorized" in error_message or "unauthorized" in error_message.lower():
-                        user_friendly_error += "Your API key may be invalid. Please set a new key with /apikey."
-                    elif "not found" in error_message.lower() or "404" in error_message:
-                        user_friendly_error += f"The model '{model}' may not be available. Try changing models with /model."
-                    else:
-                        user_friendly_error += f"Error details: {error_message}"
-                        
+                    category, user_friendly_error = describe_error(e, model)
+                    bot.metrics.errors.inc(category)
                     await message.reply(user_friendly_error)
     
     return bot
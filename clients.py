@@ -0,0 +1,117 @@
+import asyncio
+import hashlib
+import time
+
+import httpx
+from openai import AsyncOpenAI, AuthenticationError, DefaultAsyncHttpxClient, PermissionDeniedError
+
+DEEPSEEK_BASE_URL = "https://api.deepseek.com"
+
+class ClientPool:
+    """Keeps one AsyncOpenAI client per API key and endpoint so connections are reused.
+
+    Each client owns an httpx connection pool with keep-alive, so repeat
+    requests for a guild skip the TLS handshake. Clients that have not been
+    used for idle_ttl seconds are closed by a background sweep.
+    """
+
+    def __init__(self, base_url=DEEPSEEK_BASE_URL, max_connections=20, idle_ttl=300.0,
+                 validate_timeout=5.0, validate_ttl=300.0):
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.idle_ttl = idle_ttl
+        self.validate_timeout = validate_timeout
+        self.validate_ttl = validate_ttl
+        # (base_url, api_key) -> [client, last_used]
+        self._clients = {}
+        # sha256(api_key) -> (error message or None, expires_at)
+        self._validated = {}
+        self._sweeper = None
+
+    def start(self):
+        """Start the idle-client sweep. Must be called from a running loop."""
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep())
+
+    def get(self, api_key: str, base_url: str = None):
+        base_url = base_url or self.base_url
+        entry = self._clients.get((base_url, api_key))
+        if entry is None:
+            http_client = DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=self.idle_ttl,
+                )
+            )
+            # Retries are left to Resilience, which knows the request's deadline
+            client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+            entry = [client, 0.0]
+            self._clients[(base_url, api_key)] = entry
+        entry[1] = time.monotonic()
+        return entry[0]
+
+    async def validate(self, api_key: str):
+        """Check a key with a models listing; return None if it works, else the error.
+
+        Verdicts are cached by key hash for validate_ttl seconds, so resubmitting
+        a key answers instantly. Timeouts and connection errors say nothing
+        about the key, so they are raised instead of cached. The check runs on
+        the pooled client, leaving a warm connection for the first question.
+        """
+        digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+        now = time.monotonic()
+        cached = self._validated.get(digest)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
+        client = self.get(api_key)
+        try:
+            await client.with_options(timeout=self.validate_timeout, max_retries=0).models.list()
+            error = None
+        except (AuthenticationError, PermissionDeniedError) as e:
+            error = str(e)
+        except Exception:
+            await self.discard(api_key)
+            raise
+        if error is not None:
+            # Don't keep a pooled client around for a key that doesn't work
+            await self.discard(api_key)
+
+        expired = [key for key, (_, expires_at) in self._validated.items() if expires_at <= now]
+        for key in expired:
+            del self._validated[key]
+        self._validated[digest] = (error, now + self.validate_ttl)
+        return error
+
+    async def _close(self, key):
+        entry = self._clients.pop(key, None)
+        if entry is not None:
+            await entry[0].close()
+
+    async def discard(self, api_key: str):
+        """Close and forget every client for a key, e.g. after it failed validation."""
+        for key in [key for key in self._clients if key[1] == api_key]:
+            await self._close(key)
+
+    async def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        idle = [key for key, (_, last_used) in self._clients.items() if last_used < cutoff]
+        for key in idle:
+            await self._close(key)
+        return len(idle)
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.idle_ttl / 2)
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                print(f"Error evicting idle DeepSeek clients: {str(e)}")
+
+    async def close(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        for key in list(self._clients):
+            await self._close(key)
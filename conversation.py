@@ -0,0 +1,168 @@
+import time
+from collections import OrderedDict, deque
+
+def estimate_tokens(text: str):
+    """Cheap token estimate (about 4 characters per token); computed once per turn."""
+    return len(text) // 4 + 1
+
+def build_messages(system_prompt: str, history: list, prompt: str, context: list = None):
+    """Assemble a request with its most stable parts first.
+
+    DeepSeek caches prompt prefixes, so the guild's system prompt always
+    leads, unchanged, followed by the history oldest first and only then the
+    new question. Anything that varies per request (names, times, retrieved
+    context) belongs in the user message, never in the system prompt.
+    """
+    if context:
+        prompt = (
+            "Earlier messages from this channel that may be relevant:\n"
+            + "\n".join(f"- {snippet}" for snippet in context)
+            + f"\n\nQuestion: {prompt}"
+        )
+    return [
+        {"role": "system", "content": system_prompt},
+        *history,
+        {"role": "user", "content": prompt},
+    ]
+
+class Conversation:
+    __slots__ = ("exchanges", "tokens", "updated")
+
+    def __init__(self):
+        # (user_content, assistant_content, tokens), oldest first
+        self.exchanges = deque()
+        self.tokens = 0
+        # When the newest exchange was stored
+        self.updated = 0.0
+
+    def append(self, user_content, assistant_content, tokens, budget, updated=None):
+        self.exchanges.append((user_content, assistant_content, tokens))
+        self.tokens += tokens
+        self.updated = time.time() if updated is None else updated
+        # Drop the oldest exchanges until the history fits the budget again
+        while self.tokens > budget and self.exchanges:
+            self.tokens -= self.exchanges.popleft()[2]
+
+class ConversationStore:
+    """Recent exchanges per channel, thread or reply chain, used as history for the next prompt.
+
+    Each conversation keeps a running token total and is trimmed oldest-first
+    whenever a new exchange pushes it over token_budget, so building a prompt
+    never re-reads or re-counts the history. Exchanges are also written to the
+    conversation_exchanges table and reloaded after a restart or eviction.
+
+    A channel's conversation starts over once it has been quiet for
+    idle_timeout seconds, so a standalone question asked later is sent
+    without history (and can be answered from the response cache). Reply
+    chains never expire: replying to an answer asks for its context.
+    """
+
+    def __init__(self, db, token_budget=2000, max_conversations=1000, idle_timeout=1800.0):
+        self.db = db
+        self.token_budget = token_budget
+        self.max_conversations = max_conversations
+        self.idle_timeout = idle_timeout
+        self._conversations = OrderedDict()
+        # Bot reply message id -> the conversation it was part of, for following reply chains
+        self._replies = OrderedDict()
+
+    @property
+    def enabled(self):
+        return self.token_budget > 0
+
+    def _remember(self, reply_message_id: int, conversation_id: int):
+        self._replies[reply_message_id] = conversation_id
+        if len(self._replies) > self.max_conversations * 10:
+            self._replies.popitem(last=False)
+
+    async def resolve(self, channel_id: int, reference_id: int = None):
+        """Pick the conversation a message belongs to.
+
+        Anything that isn't a reply to one of our answers continues the
+        channel's (or thread's) conversation. A reply continues the chain
+        that answer belongs to; replying to an answer from the channel's
+        conversation starts a new chain keyed on that answer, seeded with
+        the exchange that produced it, so it picks up from there rather
+        than from whatever the channel talked about since.
+        """
+        if reference_id is None:
+            return await self._channel(channel_id)
+        conversation_id = self._replies.get(reference_id)
+        if conversation_id is not None and conversation_id != channel_id:
+            return conversation_id
+
+        exchange = await self.db.get_reply_exchange(reference_id)
+        # Another reply to the same answer may have started its chain meanwhile
+        conversation_id = self._replies.get(reference_id)
+        if conversation_id is not None and conversation_id != channel_id:
+            return conversation_id
+        if exchange is None:
+            return await self._channel(channel_id)
+
+        conversation_id, guild_id, user_content, assistant_content, tokens = exchange
+        if conversation_id == channel_id:
+            conversation_id = reference_id
+            self._remember(reference_id, conversation_id)
+            self._conversations.pop(conversation_id, None)
+            await self.db.add_conversation_exchange(
+                conversation_id, guild_id, user_content, assistant_content, tokens, reference_id
+            )
+        else:
+            self._remember(reference_id, conversation_id)
+        return conversation_id
+
+    async def _channel(self, channel_id: int):
+        """Return the channel's conversation id, first dropping its history if it has gone idle."""
+        if self.enabled and self.idle_timeout:
+            since = time.time() - self.idle_timeout
+            conversation = await self._load(channel_id, since)
+            if conversation.updated < since:
+                conversation.exchanges.clear()
+                conversation.tokens = 0
+        return channel_id
+
+    async def _load(self, conversation_id: int, since: float = None):
+        conversation = self._conversations.get(conversation_id)
+        if conversation is not None:
+            self._conversations.move_to_end(conversation_id)
+            return conversation
+
+        conversation = Conversation()
+        rows = await self.db.get_conversation_exchanges(conversation_id, self.token_budget, since)
+        for user_content, assistant_content, tokens, created_at in rows:
+            # Rows from before created_at was stored count as long idle
+            conversation.append(user_content, assistant_content, tokens, self.token_budget, created_at or 0.0)
+        # Keep whichever copy won if another message loaded it meanwhile
+        conversation = self._conversations.setdefault(conversation_id, conversation)
+        if len(self._conversations) > self.max_conversations:
+            self._conversations.popitem(last=False)
+        return conversation
+
+    async def history(self, conversation_id: int):
+        """Return the conversation as chat messages, oldest first."""
+        if not self.enabled:
+            return []
+        conversation = await self._load(conversation_id)
+        messages = []
+        for user_content, assistant_content, _ in conversation.exchanges:
+            messages.append({"role": "user", "content": user_content})
+            messages.append({"role": "assistant", "content": assistant_content})
+        return messages
+
+    async def record(self, conversation_id: int, guild_id: int, user_content: str, assistant_content: str, reply_message_id: int = None):
+        if not self.enabled:
+            return
+        conversation = await self._load(conversation_id)
+        if reply_message_id is not None:
+            self._remember(reply_message_id, conversation_id)
+
+        # Everyone who shared one upstream call records the same exchange;
+        # keep a single copy so it doesn't crowd out the rest of the history
+        if conversation.exchanges and conversation.exchanges[-1][:2] == (user_content, assistant_content):
+            return
+
+        tokens = estimate_tokens(user_content) + estimate_tokens(assistant_content)
+        conversation.append(user_content, assistant_content, tokens, self.token_budget)
+        await self.db.add_conversation_exchange(
+            conversation_id, guild_id, user_content, assistant_content, tokens, reply_message_id
+        )
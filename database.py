@@ -1,153 +1,400 @@
 import aiosqlite
+import asyncio
 import json
+import sqlite3
+import time
+
+from storage import SQLiteSettingsStore
+
+# Applied once to the shared connection. WAL lets reads run while a write is
+# in progress, and synchronous=NORMAL stays crash-safe under WAL while
+# skipping the fsync on every commit.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+)
+
+# Token counters kept per guild and model in guild_usage, as reported in response.usage
+USAGE_COLUMNS = (
+    "requests",
+    "prompt_tokens",
+    "completion_tokens",
+    "prompt_cache_hit_tokens",
+    "prompt_cache_miss_tokens",
+)
+
+# Conversation exchanges kept on disk per conversation; older ones are pruned
+MAX_STORED_EXCHANGES = 50
+
+# Attempts at a write that finds the database locked by another process even
+# after busy_timeout, e.g. when several shard processes share one file
+WRITE_ATTEMPTS = 5
 
 class Database:
-    def __init__(self, db_path="bot.db"):
+    def __init__(self, db_path="bot.db", flush_interval=0, store=None):
         self.db_path = db_path
+        self.conn = None
+        self._write_lock = None
+        # Guild settings and bot state go through here (see storage.py);
+        # everything else stays in SQLite
+        self.store = store if store is not None else SQLiteSettingsStore(self)
+        # Write-behind: writes made with defer=True are coalesced per guild and
+        # committed together every flush_interval seconds. 0 disables it.
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._flush_task = None
 
     async def init(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS settings (
-                    guild_id INTEGER PRIMARY KEY,
-                    api_key TEXT,
-                    current_model TEXT DEFAULT 'deepseek-chat',
-                    model_message_id INTEGER,
-                    model_channel_id INTEGER,
-                    welcome_sent INTEGER DEFAULT 0
-                )
-            """)
-            await db.commit()
+        # One long-lived connection (and worker thread) for the whole process.
+        # sqlite3 caches compiled statements per connection keyed on the SQL
+        # text, so the constant queries below are prepared once and reused.
+        self.conn = await aiosqlite.connect(self.db_path, cached_statements=128)
+        self._write_lock = asyncio.Lock()
+        for pragma in PRAGMAS:
+            await self.conn.execute(pragma)
+
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS conversation_exchanges (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                conversation_id INTEGER NOT NULL,
+                guild_id INTEGER,
+                user_content TEXT NOT NULL,
+                assistant_content TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                reply_message_id INTEGER,
+                created_at REAL
+            )
+        """)
+        # Added after the original schema; older rows read as long idle
+        async with self.conn.execute("PRAGMA table_info(conversation_exchanges)") as cursor:
+            existing = {row[1] for row in await cursor.fetchall()}
+        if "created_at" not in existing:
+            try:
+                await self.conn.execute("ALTER TABLE conversation_exchanges ADD COLUMN created_at REAL")
+            except sqlite3.OperationalError as e:
+                # Another shard process added it first
+                if "duplicate column" not in str(e):
+                    raise
+        await self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_exchanges_conversation ON conversation_exchanges (conversation_id, id)"
+        )
+        await self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_exchanges_reply ON conversation_exchanges (reply_message_id)"
+        )
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                cache_key TEXT PRIMARY KEY,
+                guild_id INTEGER,
+                content TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        await self.conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+        await self.conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS guild_usage (
+                guild_id INTEGER NOT NULL,
+                model TEXT NOT NULL,
+                {", ".join(f"{column} INTEGER NOT NULL DEFAULT 0" for column in USAGE_COLUMNS)},
+                PRIMARY KEY (guild_id, model)
+            )
+        """)
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS retrieval_channels (
+                channel_id INTEGER PRIMARY KEY,
+                guild_id INTEGER NOT NULL
+            )
+        """)
+        # Text for each row of a guild's retrieval matrix (see retrieval.py)
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS retrieval_snippets (
+                guild_id INTEGER NOT NULL,
+                row INTEGER NOT NULL,
+                channel_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                author TEXT,
+                content TEXT NOT NULL,
+                PRIMARY KEY (guild_id, row)
+            )
+        """)
+        await self.store.init()
+        await self.conn.commit()
+
+    async def close(self):
+        """Flush deferred writes and close the shared connection. Safe to call more than once."""
+        if self.conn is None:
+            return
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        await self.store.close()
+        # Move the WAL into the main database file so nothing committed is
+        # left depending on the -wal file after shutdown
+        await self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        await self.conn.close()
+        self.conn = None
+
+    async def _transaction(self, write):
+        """Run write() and commit, retrying with backoff while another process holds the lock."""
+        for attempt in range(WRITE_ATTEMPTS):
+            async with self._write_lock:
+                try:
+                    await write()
+                    await self.conn.commit()
+                    return
+                except sqlite3.OperationalError as e:
+                    await self.conn.rollback()
+                    if "locked" not in str(e) or attempt == WRITE_ATTEMPTS - 1:
+                        raise
+            await asyncio.sleep(0.05 * 2 ** attempt)
+
+    async def _write(self, guild_id: int, values: dict, defer=False):
+        if defer and self.flush_interval > 0:
+            self._pending.setdefault(guild_id, {}).update(values)
+            if self._flush_task is None:
+                self._flush_task = asyncio.create_task(self._flush_later())
+            return
+
+        # An immediate write is newer than anything queued for the same columns
+        pending = self._pending.get(guild_id)
+        if pending:
+            for column in values:
+                pending.pop(column, None)
+
+        await self.store.update_settings({guild_id: values})
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self._flush_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error flushing deferred settings writes: {str(e)}")
+
+    async def flush(self):
+        """Commit every deferred write in a single transaction."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            await self.store.update_settings(pending)
+        except Exception:
+            # Put the batch back underneath anything queued since
+            for guild_id, values in pending.items():
+                self._pending[guild_id] = {**values, **self._pending.get(guild_id, {})}
+            raise
+
+    async def _setting(self, guild_id: int, column: str, default):
+        pending = self._pending.get(guild_id, {})
+        if column in pending:
+            return pending[column]
+        row = await self.store.get_settings(guild_id)
+        return row[column] if row else default
 
     async def set_api_key(self, guild_id: int, api_key: str):
-        async with aiosqlite.connect(self.db_path) as db:
-            # Check if record exists
-            async with db.execute(
-                "SELECT guild_id FROM settings WHERE guild_id = ?",
-                (guild_id,)
-            ) as cursor:
-                exists = await cursor.fetchone()
-                
-            if exists:
-                # Update existing record
-                await db.execute(
-                    "UPDATE settings SET api_key = ? WHERE guild_id = ?",
-                    (api_key, guild_id)
-                )
-            else:
-                # Insert new record with defaults
-                await db.execute(
-                    "INSERT INTO settings (guild_id, api_key, current_model) VALUES (?, ?, 'deepseek-chat')",
-                    (guild_id, api_key)
-                )
-            await db.commit()
+        await self._write(guild_id, {"api_key": api_key})
 
     async def get_api_key(self, guild_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                "SELECT api_key FROM settings WHERE guild_id = ?",
-                (guild_id,)
-            ) as cursor:
-                result = await cursor.fetchone()
-                return result[0] if result else None
-
-    async def set_model(self, guild_id: int, model: str):
-        async with aiosqlite.connect(self.db_path) as db:
-            # Check if record exists
-            async with db.execute(
-                "SELECT guild_id FROM settings WHERE guild_id = ?",
-                (guild_id,)
-            ) as cursor:
-                exists = await cursor.fetchone()
-                
-            if exists:
-                # Update existing record
-                await db.execute(
-                    "UPDATE settings SET current_model = ? WHERE guild_id = ?",
-                    (model, guild_id)
-                )
-            else:
-                # Insert new record with defaults
-                await db.execute(
-                    "INSERT INTO settings (guild_id, current_model) VALUES (?, ?)",
-                    (guild_id, model)
-                )
-            await db.commit()
+        return await self._setting(guild_id, "api_key", None)
+
+    async def set_model(self, guild_id: int, model: str, defer=False):
+        await self._write(guild_id, {"current_model": model}, defer)
 
     async def get_model(self, guild_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                "SELECT current_model FROM settings WHERE guild_id = ?",
-                (guild_id,)
-            ) as cursor:
-                result = await cursor.fetchone()
-                return result[0] if result else 'deepseek-chat'
-
-    async def update_model_message(self, guild_id: int, message_id: int, channel_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            # Check if record exists
-            async with db.execute(
-                "SELECT guild_id FROM settings WHERE guild_id = ?",
-                (guild_id,)
-            ) as cursor:
-                exists = await cursor.fetchone()
-                
-            if exists:
-                # Update existing record
-                await db.execute(
-                    "UPDATE settings SET model_message_id = ?, model_channel_id = ? WHERE guild_id = ?",
-                    (message_id, channel_id, guild_id)
-                )
-            else:
-                # Insert new record with defaults
-                await db.execute(
-                    """INSERT INTO settings 
-                      (guild_id, model_message_id, model_channel_id, current_model) 
-                      VALUES (?, ?, ?, 'deepseek-chat')""",
-                    (guild_id, message_id, channel_id)
-                )
-            await db.commit()
-
-    async def get_model_message(self, guild_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                """SELECT model_message_id, model_channel_id 
-                   FROM settings WHERE guild_id = ?""",
-                (guild_id,)
-            ) as cursor:
-                result = await cursor.fetchone()
-                return result if result else (None, None)
-                
+        return await self._setting(guild_id, "current_model", 'deepseek-chat')
+
     async def get_welcome_sent(self, guild_id: int):
         """Check if welcome message has been sent to a guild."""
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                "SELECT welcome_sent FROM settings WHERE guild_id = ?", 
-                (guild_id,)
-            ) as cursor:
-                result = await cursor.fetchone()
-                return bool(result[0]) if result else False
-    
-    async def set_welcome_sent(self, guild_id: int, sent=True):
+        return bool(await self._setting(guild_id, "welcome_sent", False))
+
+    async def set_welcome_sent(self, guild_id: int, sent=True, defer=False):
         """Mark that welcome message has been sent to a guild."""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Check if record exists
-            async with db.execute(
-                "SELECT guild_id FROM settings WHERE guild_id = ?",
-                (guild_id,)
-            ) as cursor:
-                exists = await cursor.fetchone()
-                
-            if exists:
-                # Update existing record
-                await db.execute(
-                    "UPDATE settings SET welcome_sent = ? WHERE guild_id = ?",
-                    (int(sent), guild_id)
-                )
-            else:
-                # Insert new record with defaults
-                await db.execute(
-                    "INSERT INTO settings (guild_id, welcome_sent, current_model) VALUES (?, ?, 'deepseek-chat')",
-                    (guild_id, int(sent))
-                )
-            await db.commit()
\ No newline at end of file
+        await self._write(guild_id, {"welcome_sent": int(sent)}, defer)
+
+    async def get_response_cache(self, guild_id: int):
+        """Check if a guild has opted in to response caching."""
+        return bool(await self._setting(guild_id, "response_cache", False))
+
+    async def set_response_cache(self, guild_id: int, enabled: bool):
+        await self._write(guild_id, {"response_cache": int(enabled)})
+
+    async def get_system_prompt(self, guild_id: int):
+        """A guild's own system prompt, or None to use the default."""
+        return await self._setting(guild_id, "system_prompt", None)
+
+    async def set_system_prompt(self, guild_id: int, system_prompt: str):
+        await self._write(guild_id, {"system_prompt": system_prompt})
+
+    async def get_settings(self, guild_id: int):
+        """Fetch a guild's whole settings row as a dict, or None if it has none."""
+        result = await self.store.get_settings(guild_id)
+        pending = self._pending.get(guild_id)
+        if not result:
+            return dict(pending) if pending else None
+        return {**result, **(pending or {})}
+
+    async def get_all_settings(self):
+        """Fetch every guild's settings row in one query, as {guild_id: row dict}."""
+        rows = await self.store.get_all_settings()
+        for guild_id, values in self._pending.items():
+            rows[guild_id] = {**rows.get(guild_id, {}), **values}
+        return rows
+
+    async def get_state(self, key: str):
+        """Read a process-wide value such as the last synced command hash."""
+        return await self.store.get_state(key)
+
+    async def set_state(self, key: str, value: str):
+        await self.store.set_state(key, value)
+
+    async def add_conversation_exchange(self, conversation_id: int, guild_id: int, user_content: str,
+                                        assistant_content: str, tokens: int, reply_message_id: int = None):
+        """Store one user/assistant exchange and prune the conversation's oldest ones."""
+        async def write():
+            await self.conn.execute(
+                """INSERT INTO conversation_exchanges
+                   (conversation_id, guild_id, user_content, assistant_content, tokens, reply_message_id, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (conversation_id, guild_id, user_content, assistant_content, tokens, reply_message_id, time.time())
+            )
+            await self.conn.execute(
+                """DELETE FROM conversation_exchanges
+                   WHERE conversation_id = ? AND id <= (
+                       SELECT id FROM conversation_exchanges WHERE conversation_id = ?
+                       ORDER BY id DESC LIMIT 1 OFFSET ?
+                   )""",
+                (conversation_id, conversation_id, MAX_STORED_EXCHANGES)
+            )
+
+        await self._transaction(write)
+
+    async def get_conversation_exchanges(self, conversation_id: int, token_budget: int, since: float = None):
+        """Return the newest exchanges that fit in token_budget, oldest first, as
+        (user_content, assistant_content, tokens, created_at).
+
+        With since, only exchanges stored at or after that time.
+        """
+        async with self.conn.execute(
+            """SELECT user_content, assistant_content, tokens, created_at FROM conversation_exchanges
+               WHERE conversation_id = ? AND (? IS NULL OR created_at >= ?) ORDER BY id DESC LIMIT ?""",
+            (conversation_id, since, since, MAX_STORED_EXCHANGES)
+        ) as cursor:
+            rows = await cursor.fetchall()
+
+        exchanges = []
+        total = 0
+        for row in rows:
+            total += row[2]
+            if total > token_budget:
+                break
+            exchanges.append(row)
+        exchanges.reverse()
+        return exchanges
+
+    async def get_reply_exchange(self, reply_message_id: int):
+        """Return (conversation_id, guild_id, user_content, assistant_content, tokens) for a bot reply, or None.
+
+        The newest row wins: an answer that started a reply chain is also
+        stored as that chain's first exchange.
+        """
+        async with self.conn.execute(
+            """SELECT conversation_id, guild_id, user_content, assistant_content, tokens
+               FROM conversation_exchanges WHERE reply_message_id = ? ORDER BY id DESC LIMIT 1""",
+            (reply_message_id,)
+        ) as cursor:
+            result = await cursor.fetchone()
+            return tuple(result) if result else None
+
+    async def get_cached_response(self, cache_key: str, now: float):
+        """Return (expires_at, content) for an unexpired cached response, or None."""
+        async with self.conn.execute(
+            "SELECT expires_at, content FROM response_cache WHERE cache_key = ? AND expires_at > ?",
+            (cache_key, now)
+        ) as cursor:
+            result = await cursor.fetchone()
+            return tuple(result) if result else None
+
+    async def set_cached_response(self, cache_key: str, guild_id: int, content: str, expires_at: float):
+        await self._transaction(lambda: self.conn.execute(
+            """INSERT INTO response_cache (cache_key, guild_id, content, expires_at) VALUES (?, ?, ?, ?)
+               ON CONFLICT(cache_key) DO UPDATE SET content = excluded.content, expires_at = excluded.expires_at""",
+            (cache_key, guild_id, content, expires_at)
+        ))
+
+    async def prune_cached_responses(self, now: float, max_rows: int):
+        """Delete expired cached responses, then all but the max_rows that expire last."""
+        async def write():
+            await self.conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+            await self.conn.execute(
+                """DELETE FROM response_cache WHERE cache_key NOT IN (
+                       SELECT cache_key FROM response_cache ORDER BY expires_at DESC LIMIT ?
+                   )""",
+                (max_rows,)
+            )
+
+        await self._transaction(write)
+
+    async def add_usage(self, usage: dict):
+        """Add {(guild_id, model): [count per USAGE_COLUMNS]} to the totals in one transaction."""
+        columns = ", ".join(USAGE_COLUMNS)
+        placeholders = ", ".join("?" for _ in USAGE_COLUMNS)
+        assignments = ", ".join(f"{column} = {column} + excluded.{column}" for column in USAGE_COLUMNS)
+        await self._transaction(lambda: self.conn.executemany(
+            f"""INSERT INTO guild_usage (guild_id, model, {columns}) VALUES (?, ?, {placeholders})
+                ON CONFLICT(guild_id, model) DO UPDATE SET {assignments}""",
+            [(guild_id, model, *counts) for (guild_id, model), counts in usage.items()]
+        ))
+
+    async def get_usage(self, guild_id: int):
+        """Return a guild's usage totals as {model: {column: count}}."""
+        async with self.conn.execute(
+            f"SELECT model, {', '.join(USAGE_COLUMNS)} FROM guild_usage WHERE guild_id = ?",
+            (guild_id,)
+        ) as cursor:
+            return {row[0]: dict(zip(USAGE_COLUMNS, row[1:])) for row in await cursor.fetchall()}
+
+    async def get_retrieval_channels(self):
+        """Return {channel_id: guild_id} for every channel with retrieval turned on."""
+        async with self.conn.execute("SELECT channel_id, guild_id FROM retrieval_channels") as cursor:
+            return {row[0]: row[1] for row in await cursor.fetchall()}
+
+    async def set_retrieval_channel(self, guild_id: int, channel_id: int, enabled: bool):
+        if enabled:
+            await self._transaction(lambda: self.conn.execute(
+                "INSERT OR REPLACE INTO retrieval_channels (channel_id, guild_id) VALUES (?, ?)",
+                (channel_id, guild_id)
+            ))
+        else:
+            await self._transaction(lambda: self.conn.execute(
+                "DELETE FROM retrieval_channels WHERE channel_id = ?",
+                (channel_id,)
+            ))
+
+    async def add_retrieval_snippets(self, guild_id: int, snippets: list):
+        """Store [(row, channel_id, message_id, author, content)] for a guild in one transaction."""
+        await self._transaction(lambda: self.conn.executemany(
+            """INSERT OR REPLACE INTO retrieval_snippets (guild_id, row, channel_id, message_id, author, content)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            [(guild_id, *snippet) for snippet in snippets]
+        ))
+
+    async def get_retrieval_rows(self, guild_id: int):
+        """Return the channel id of each of a guild's retrieval rows, in row order."""
+        async with self.conn.execute(
+            "SELECT channel_id FROM retrieval_snippets WHERE guild_id = ? ORDER BY row",
+            (guild_id,)
+        ) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+    async def get_retrieval_snippets(self, guild_id: int, rows: list):
+        """Return {row: (message_id, author, content)} for the given rows."""
+        placeholders = ", ".join("?" for _ in rows)
+        async with self.conn.execute(
+            f"""SELECT row, message_id, author, content FROM retrieval_snippets
+                WHERE guild_id = ? AND row IN ({placeholders})""",
+            (guild_id, *rows)
+        ) as cursor:
+            return {row[0]: tuple(row[1:]) for row in await cursor.fetchall()}
@@ -0,0 +1,101 @@
+from collections import OrderedDict
+
+from storage import DEFAULT_SETTINGS
+
+class GuildSettings:
+    """In-memory LRU cache of guild settings rows in front of Database.
+
+    Reads load a guild's whole row in one query and are then served from
+    memory. Writes go to the database first (or its write-behind queue when
+    deferred) and are then applied to the cached row.
+    """
+
+    def __init__(self, db, max_guilds=10000):
+        self.db = db
+        self.max_guilds = max_guilds
+        self._rows = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def _row(self, guild_id: int):
+        row = self._rows.get(guild_id)
+        if row is not None:
+            self._rows.move_to_end(guild_id)
+            self.hits += 1
+            return row
+
+        self.misses += 1
+        loaded = await self.db.get_settings(guild_id)
+        # Another coroutine may have loaded (and written to) this guild while
+        # we were waiting on the query; its row is at least as fresh as ours
+        row = self._rows.get(guild_id)
+        if row is None:
+            row = dict(DEFAULT_SETTINGS, **(loaded or {}))
+            self._rows[guild_id] = row
+            if len(self._rows) > self.max_guilds:
+                self._rows.popitem(last=False)
+        return row
+
+    async def _write(self, guild_id: int, **values):
+        row = await self._row(guild_id)
+        row.update(values)
+
+    def preload(self, rows: dict):
+        """Seed the cache from Database.get_all_settings(), up to its size limit."""
+        for guild_id, row in list(rows.items())[:self.max_guilds]:
+            if guild_id not in self._rows:
+                self._rows[guild_id] = dict(DEFAULT_SETTINGS, **row)
+        while len(self._rows) > self.max_guilds:
+            self._rows.popitem(last=False)
+
+    def invalidate(self, guild_id: int = None):
+        """Drop one guild's cached row, or every row if no guild is given."""
+        if guild_id is None:
+            self._rows.clear()
+        else:
+            self._rows.pop(guild_id, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._rows),
+            "max_size": self.max_guilds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    async def get_api_key(self, guild_id: int):
+        return (await self._row(guild_id))["api_key"]
+
+    async def set_api_key(self, guild_id: int, api_key: str):
+        await self.db.set_api_key(guild_id, api_key)
+        await self._write(guild_id, api_key=api_key)
+
+    async def get_model(self, guild_id: int):
+        return (await self._row(guild_id))["current_model"]
+
+    async def set_model(self, guild_id: int, model: str, defer=False):
+        await self.db.set_model(guild_id, model, defer)
+        await self._write(guild_id, current_model=model)
+
+    async def get_welcome_sent(self, guild_id: int):
+        return bool((await self._row(guild_id))["welcome_sent"])
+
+    async def set_welcome_sent(self, guild_id: int, sent=True, defer=False):
+        await self.db.set_welcome_sent(guild_id, sent, defer)
+        await self._write(guild_id, welcome_sent=int(sent))
+
+    async def get_response_cache(self, guild_id: int):
+        return bool((await self._row(guild_id))["response_cache"])
+
+    async def set_response_cache(self, guild_id: int, enabled: bool):
+        await self.db.set_response_cache(guild_id, enabled)
+        await self._write(guild_id, response_cache=int(enabled))
+
+    async def get_system_prompt(self, guild_id: int):
+        return (await self._row(guild_id))["system_prompt"]
+
+    async def set_system_prompt(self, guild_id: int, system_prompt: str):
+        await self.db.set_system_prompt(guild_id, system_prompt)
+        await self._write(guild_id, system_prompt=system_prompt)
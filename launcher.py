@@ -0,0 +1,89 @@
+"""Run the bot as several processes, each owning a contiguous group of shards.
+
+Usage: python launcher.py --shards 8 --processes 2
+
+Every process opens the same SQLite database; WAL mode and the busy-timeout
+retries in Database let them share it. Guild state stays coherent because
+each guild is handled by exactly one shard, and so by one process.
+"""
+import argparse
+import multiprocessing
+import os
+import time
+
+from dotenv import load_dotenv
+
+def run_shard_group(shard_ids, shard_count, index=0):
+    from bot import create_bot
+
+    load_dotenv()
+    # Each process serves its own metrics, on consecutive ports
+    if os.getenv('METRICS_PORT'):
+        os.environ['METRICS_PORT'] = str(int(os.getenv('METRICS_PORT')) + index)
+    bot = create_bot(shard_ids=shard_ids, shard_count=shard_count)
+    bot.run(os.getenv('DISCORD_TOKEN'))
+
+def shard_groups(shard_count, processes):
+    """Split shard ids 0..shard_count-1 into at most `processes` contiguous groups."""
+    size, extra = divmod(shard_count, processes)
+    groups = []
+    start = 0
+    for index in range(processes):
+        end = start + size + (1 if index < extra else 0)
+        if end > start:
+            groups.append(list(range(start, end)))
+        start = end
+    return groups
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shards", type=int, required=True, help="total number of shards")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--stagger", type=float, default=5.0,
+        help="seconds between process starts, to respect Discord's identify rate limit"
+    )
+    parser.add_argument(
+        "--shutdown-timeout", type=float, default=30.0,
+        help="seconds to let processes flush pending writes on Ctrl+C before killing them"
+    )
+    args = parser.parse_args()
+
+    load_dotenv()
+    if not os.getenv('DISCORD_TOKEN'):
+        raise ValueError("No Discord token found in .env file. Please add DISCORD_TOKEN=your_token_here to your .env file.")
+
+    processes = []
+    for index, group in enumerate(shard_groups(args.shards, args.processes)):
+        if processes:
+            time.sleep(args.stagger)
+        process = multiprocessing.Process(
+            target=run_shard_group,
+            args=(group, args.shards, index),
+            name=f"shards-{group[0]}-{group[-1]}"
+        )
+        process.start()
+        print(f"Started {process.name} (pid {process.pid})")
+        processes.append(process)
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # The children got the SIGINT too and are closing down; give them time
+        # to flush deferred settings, usage and retrieval writes
+        deadline = time.monotonic() + args.shutdown_timeout
+        try:
+            for process in processes:
+                process.join(max(0.0, deadline - time.monotonic()))
+        except KeyboardInterrupt:
+            pass
+        for process in processes:
+            if process.is_alive():
+                print(f"{process.name} did not exit in time; terminating it")
+                process.terminate()
+        for process in processes:
+            process.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import functools
+import inspect
+import time
+from bisect import bisect_left
+
+from aiohttp import web
+
+# Seconds; spans DB calls (sub-millisecond) up to slow reasoner completions
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+)
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    pairs.extend(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def total(self):
+        return sum(self._values.values())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+class Gauge:
+    """A value read from a callback at scrape time, so the hot path pays nothing.
+
+    With labels, read() returns {label values tuple: value} instead.
+    """
+
+    def __init__(self, name, help_text, read, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+        self.labels = labels
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        if not self.labels:
+            lines.append(f"{self.name} {self.read()}")
+            return lines
+        for label_values, value in self.read().items():
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram; observe() is a bisect and two increments."""
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per-bucket counts (+Inf last), sum]
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def count(self):
+        """Observations so far, across every label set."""
+        return sum(sum(counts) for counts, _ in self._series.values())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_label = f'le="{le}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, label_values, [bucket_label])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {cumulative}")
+        return lines
+
+class Metrics:
+    """Process metrics, served in Prometheus text format when a port is configured."""
+
+    def __init__(self):
+        self.llm_latency = Histogram(
+            "deepseek_request_seconds", "Duration of DeepSeek completion calls.", ("model",)
+        )
+        self.time_to_first_token = Histogram(
+            "deepseek_time_to_first_token_seconds", "Time until the first streamed token arrives.", ("model",)
+        )
+        self.db_latency = Histogram(
+            "database_call_seconds", "Duration of Database method calls.", ("method",)
+        )
+        self.discord_latency = Histogram(
+            "discord_call_seconds", "Duration of Discord message sends and edits.", ("action",)
+        )
+        self.requests = Counter("bot_requests_total", "Questions received.", ("source",))
+        self.errors = Counter("bot_errors_total", "Failed requests by error category.", ("category",))
+        self.tokens = Counter("deepseek_tokens_total", "Tokens reported in response.usage.", ("model", "kind"))
+        self.routes = Counter("auto_route_total", "Prompts the auto model sent to each model.", ("model",))
+        self.route_saved = Counter(
+            "auto_route_saved_seconds_total", "Estimated latency saved by routing prompts to chat."
+        )
+        self.retries = Counter("deepseek_retries_total", "DeepSeek calls retried, by error.", ("model", "error"))
+        self.hedges = Counter("deepseek_hedged_total", "Slow DeepSeek calls raced against a second attempt.", ("model",))
+        self.collectors = [
+            self.llm_latency, self.time_to_first_token, self.db_latency, self.discord_latency,
+            self.requests, self.errors, self.tokens, self.routes, self.route_saved,
+            self.retries, self.hedges,
+        ]
+        self._runner = None
+
+    def gauge(self, name, help_text, read, labels=()):
+        self.collectors.append(Gauge(name, help_text, read, labels))
+
+    def observe_discord(self, action, seconds):
+        self.discord_latency.observe(seconds, action)
+
+    def record_usage(self, model, usage):
+        if usage is None:
+            return
+        self.tokens.inc(model, "prompt", amount=usage.prompt_tokens or 0)
+        self.tokens.inc(model, "completion", amount=usage.completion_tokens or 0)
+        self.tokens.inc(model, "prompt_cache_hit", amount=getattr(usage, "prompt_cache_hit_tokens", None) or 0)
+        self.tokens.inc(model, "prompt_cache_miss", amount=getattr(usage, "prompt_cache_miss_tokens", None) or 0)
+
+    def instrument(self, obj, histogram):
+        """Time every public coroutine method of obj into histogram, labelled by method name."""
+        for name, method in inspect.getmembers(obj, inspect.iscoroutinefunction):
+            if name.startswith("_"):
+                continue
+            setattr(obj, name, self._timed(method, histogram, name))
+
+    @staticmethod
+    def _timed(method, histogram, label):
+        @functools.wraps(method)
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, label)
+        return timed
+
+    def render(self):
+        lines = []
+        for collector in self.collectors:
+            lines.extend(collector.render())
+        return "\n".join(lines) + "\n"
+
+    async def _handle(self, request):
+        return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self, host="127.0.0.1", port=9100):
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        print(f"Serving metrics on http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
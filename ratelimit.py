@@ -0,0 +1,102 @@
+import time
+
+def parse_limit(spec: str):
+    """Parse "COUNT/SECONDS" (e.g. "5/60") into (rate per second, burst); "0" or "" disables."""
+    if not spec or spec.strip() == "0":
+        return None
+    count, _, seconds = spec.partition("/")
+    count = float(count)
+    seconds = float(seconds or 1)
+    return count / seconds, count
+
+class TokenBucket:
+    """Token buckets for one scope, e.g. every user.
+
+    Each key's bucket is just [tokens, last_update]. A bucket that has sat
+    idle long enough to refill completely is indistinguishable from a new
+    one, so those are dropped by the periodic sweep.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.refill_time = burst / rate
+        self._buckets = {}
+
+    def available(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return self.burst
+        return min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+
+    def retry_after(self, key, now):
+        """Seconds until one token is available (0 if it already is)."""
+        missing = 1 - self.available(key, now)
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, key, now):
+        self._buckets[key] = [self.available(key, now) - 1, now]
+
+    def sweep(self, now):
+        idle = [key for key, (_, updated) in self._buckets.items() if now - updated >= self.refill_time]
+        for key in idle:
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+class RateLimiter:
+    """Per-user, per-channel and per-guild token buckets checked together.
+
+    A request consumes a token from every scope only when all of them have
+    one, so a throttled request doesn't drain the other buckets.
+    """
+
+    SWEEP_INTERVAL = 60.0
+
+    def __init__(self, user=None, channel=None, guild=None):
+        # (scope name, TokenBucket) for every scope that has a limit
+        self.scopes = [
+            (name, TokenBucket(*limit))
+            for name, limit in (("user", user), ("channel", channel), ("guild", guild))
+            if limit
+        ]
+        # user_id -> time until which they've already been told to slow down
+        self._notified = {}
+        self._last_sweep = time.monotonic()
+        self.throttled = 0
+
+    def check(self, user_id: int, channel_id: int, guild_id: int):
+        """Take a token for this request; return 0 if allowed, else seconds to wait."""
+        now = time.monotonic()
+        if now - self._last_sweep >= self.SWEEP_INTERVAL:
+            self._sweep(now)
+
+        keys = {"user": user_id, "channel": channel_id, "guild": guild_id}
+        retry_after = max(
+            (bucket.retry_after(keys[name], now) for name, bucket in self.scopes),
+            default=0.0
+        )
+        if retry_after > 0:
+            self.throttled += 1
+            return retry_after
+
+        for name, bucket in self.scopes:
+            bucket.take(keys[name], now)
+        return 0.0
+
+    def should_notify(self, user_id: int, retry_after: float):
+        """True the first time a user is throttled in a cooldown, False after that."""
+        now = time.monotonic()
+        if self._notified.get(user_id, 0) > now:
+            return False
+        self._notified[user_id] = now + retry_after
+        return True
+
+    def _sweep(self, now):
+        self._last_sweep = now
+        for _, bucket in self.scopes:
+            bucket.sweep(now)
+        expired = [user_id for user_id, until in self._notified.items() if until <= now]
+        for user_id in expired:
+            del self._notified[user_id]
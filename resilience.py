@@ -0,0 +1,252 @@
+import asyncio
+import hashlib
+import random
+import time
+
+import openai
+
+# Worth another attempt: the same request may well succeed a moment later
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+# The key itself is bad; every call with it will fail until it is replaced
+KEY_ERRORS = (openai.AuthenticationError, openai.PermissionDeniedError)
+
+class CircuitOpen(Exception):
+    """Raised instead of calling DeepSeek while an API key's breaker is open."""
+
+    def __init__(self, retry_after: float, unauthorized: bool):
+        super().__init__(f"Requests paused for {retry_after:.0f} seconds after repeated failures")
+        self.retry_after = retry_after
+        # True when the key was rejected, rather than DeepSeek failing
+        self.unauthorized = unauthorized
+
+def parse_deadlines(spec: str):
+    """Parse "MODEL=SECONDS,..." (e.g. "deepseek-chat=60") into {model: seconds}."""
+    deadlines = {}
+    for part in (spec or "").split(","):
+        model, _, seconds = part.partition("=")
+        if model.strip() and seconds.strip():
+            deadlines[model.strip()] = float(seconds)
+    return deadlines
+
+class CircuitBreaker:
+    __slots__ = ("failures", "opened_until", "unauthorized", "trial")
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_until = 0.0
+        self.unauthorized = False
+        # A half-open trial call is in progress
+        self.trial = False
+
+class _Progress:
+    """When a call last heard from upstream, shared by every attempt it makes."""
+
+    def __init__(self):
+        self.last = time.monotonic()
+        # Some of the answer has been shown to the user
+        self.delivered = False
+
+class _Race:
+    """Shared by the attempts of one try; only the first to produce output reaches target."""
+
+    def __init__(self, target, progress):
+        self.target = target
+        self.progress = progress
+        self.winner = None
+        self.delivered = False
+        # entrant -> task, so the winner can cancel the others
+        self.tasks = {}
+
+class _Entrant:
+    """What one attempt streams into. Quacks like a StreamingReply."""
+
+    def __init__(self, race):
+        self.race = race
+
+    def _claim(self):
+        race = self.race
+        if race.winner is None:
+            race.winner = self
+            for entrant, task in race.tasks.items():
+                if entrant is not self:
+                    task.cancel()
+        return race.winner is self
+
+    async def thinking(self):
+        if self._claim():
+            self.race.progress.last = time.monotonic()
+            await self.race.target.thinking()
+
+    async def feed(self, delta: str):
+        if self._claim():
+            self.race.delivered = self.race.progress.delivered = True
+            self.race.progress.last = time.monotonic()
+            await self.race.target.feed(delta)
+
+class Resilience:
+    """Deadlines, retries, hedging and per-key circuit breaking for DeepSeek calls.
+
+    Every call gets its model's deadline: the longest it may wait for the
+    first token, across all its attempts, and then between chunks, so a
+    long answer that keeps streaming is never cut off.
+    Retryable errors are retried up to max_retries times with exponential
+    backoff and full jitter, as long as nothing has been shown to the user
+    yet. With hedge_after set, an attempt that hasn't produced a token by
+    then is raced against a second one and the loser is cancelled.
+
+    Each API key has a breaker that opens after breaker_failures failed
+    calls in a row, or at once when the key is rejected. While it is open,
+    check() raises CircuitOpen without calling upstream; after
+    breaker_cooldown seconds one trial call is let through to close it.
+    """
+
+    def __init__(self, deadlines=None, default_deadline=120.0, max_retries=2, backoff=0.5, max_backoff=8.0,
+                 hedge_after=0.0, breaker_failures=5, breaker_cooldown=60.0, metrics=None):
+        self.deadlines = deadlines or {}
+        self.default_deadline = default_deadline
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_after = hedge_after
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self.metrics = metrics
+        # Key hash -> CircuitBreaker, only for keys that have failed since their last success
+        self._breakers = {}
+
+    @staticmethod
+    def _key(api_key: str):
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+    def deadline(self, model: str):
+        return self.deadlines.get(model, self.default_deadline)
+
+    def check(self, api_key: str):
+        """Raise CircuitOpen if calls with this key are currently paused."""
+        breaker = self._breakers.get(self._key(api_key))
+        if breaker is None:
+            return
+        now = time.monotonic()
+        if breaker.opened_until > now:
+            raise CircuitOpen(breaker.opened_until - now, breaker.unauthorized)
+        if breaker.trial:
+            # Someone else is finding out whether the key works again
+            raise CircuitOpen(1.0, breaker.unauthorized)
+
+    def reset(self, api_key: str):
+        """Close a key's breaker, e.g. after the key passed validation again."""
+        self._breakers.pop(self._key(api_key), None)
+
+    def _failed(self, key, error, delivered=False):
+        # A stall after part of the answer arrived says nothing about the key
+        stalled = delivered and isinstance(error, asyncio.TimeoutError)
+        if stalled or not isinstance(error, (*RETRYABLE_ERRORS, *KEY_ERRORS, asyncio.TimeoutError)):
+            # e.g. a bad request or unknown model: not the key's or the service's fault
+            breaker = self._breakers.get(key)
+            if breaker is not None:
+                breaker.trial = False
+            return
+        breaker = self._breakers.setdefault(key, CircuitBreaker())
+        breaker.failures += 1
+        breaker.unauthorized = isinstance(error, KEY_ERRORS)
+        if breaker.unauthorized or breaker.trial or breaker.failures >= self.breaker_failures:
+            breaker.opened_until = time.monotonic() + self.breaker_cooldown
+        breaker.trial = False
+
+    async def call(self, api_key: str, model: str, attempt, target):
+        """Run attempt(sink) until one succeeds and return its result.
+
+        attempt makes one upstream call, streaming into sink (or feeding it
+        the whole answer at once); whatever it feeds reaches target.
+        """
+        self.check(api_key)
+        key = self._key(api_key)
+        breaker = self._breakers.get(key)
+        if breaker is not None and breaker.opened_until:
+            # The cooldown is over; this call decides whether the breaker closes
+            breaker.trial = True
+
+        progress = _Progress()
+        try:
+            result = await self._watch(self._retrying(model, attempt, target, progress), progress, self.deadline(model))
+        except Exception as e:
+            self._failed(key, e, progress.delivered)
+            raise
+        self._breakers.pop(key, None)
+        return result
+
+    @staticmethod
+    async def _watch(coroutine, progress, deadline):
+        """Run coroutine, raising TimeoutError once deadline seconds pass without progress."""
+        task = asyncio.ensure_future(coroutine)
+        try:
+            while True:
+                remaining = progress.last + deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                done, _ = await asyncio.wait((task,), timeout=remaining)
+                if done:
+                    return task.result()
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+    async def _retrying(self, model, attempt, target, progress):
+        for number in range(self.max_retries + 1):
+            race = _Race(target, progress)
+            try:
+                return await self._hedged(model, attempt, race)
+            except RETRYABLE_ERRORS as e:
+                # A retry would repeat text the user has already seen
+                if race.delivered or number == self.max_retries:
+                    raise
+                if self.metrics is not None:
+                    self.metrics.retries.inc(model, type(e).__name__)
+                await asyncio.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** number)))
+
+    async def _hedged(self, model, attempt, race):
+        def start():
+            entrant = _Entrant(race)
+            race.tasks[entrant] = asyncio.ensure_future(attempt(entrant))
+            return race.tasks[entrant]
+
+        pending = {start()}
+        try:
+            if self.hedge_after:
+                done, _ = await asyncio.wait(pending, timeout=self.hedge_after)
+                if not done and race.winner is None:
+                    if self.metrics is not None:
+                        self.metrics.hedges.inc(model)
+                    pending.add(start())
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled():
+                        continue
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        continue
+                    entrant = next(entrant for entrant, entry in race.tasks.items() if entry is task)
+                    if race.winner is None or race.winner is entrant:
+                        race.winner = entrant
+                        return task.result()
+            raise error
+        finally:
+            for task in race.tasks.values():
+                task.cancel()
+            await asyncio.gather(*race.tasks.values(), return_exceptions=True)
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "open": sum(1 for breaker in self._breakers.values() if breaker.opened_until > now),
+            "failing": len(self._breakers),
+        }
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+def normalize_prompt(text: str):
+    """Fold case and whitespace so trivially different phrasings share an entry."""
+    return " ".join(text.lower().split())
+
+def cache_key(guild_id: int, model: str, system_prompt: str, prompt: str):
+    payload = json.dumps([guild_id, model, system_prompt, normalize_prompt(prompt)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """LRU + TTL cache of completed answers for guilds that opt in.
+
+    Entries are keyed on (guild, model, system prompt, normalized prompt).
+    With persist=True entries are also written to the response_cache table
+    so they survive restarts; memory is checked first, then SQLite. Every
+    prune_interval seconds the table is cleared of expired rows and cut
+    back to its max_rows newest.
+    """
+
+    def __init__(self, db, max_entries=5000, ttl=3600.0, persist=False, max_rows=50000, prune_interval=600.0):
+        self.db = db
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persist = persist
+        self.max_rows = max_rows
+        self.prune_interval = prune_interval
+        self._next_prune = time.time() + prune_interval
+        # key -> (expires_at, content)
+        self._entries = OrderedDict()
+        # guild_id -> [hits, misses]
+        self._guild_stats = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _count(self, guild_id: int, hit: bool):
+        counts = self._guild_stats.setdefault(guild_id, [0, 0])
+        if hit:
+            self.hits += 1
+            counts[0] += 1
+        else:
+            self.misses += 1
+            counts[1] += 1
+
+    def _store(self, key, expires_at, content):
+        self._entries[key] = (expires_at, content)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, guild_id: int, model: str, system_prompt: str, prompt: str):
+        key = cache_key(guild_id, model, system_prompt, prompt)
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= now:
+            del self._entries[key]
+            entry = None
+        if entry is None and self.persist:
+            entry = await self.db.get_cached_response(key, now)
+            if entry is not None:
+                self._store(key, *entry)
+
+        if entry is None:
+            self._count(guild_id, False)
+            return None
+        self._entries.move_to_end(key)
+        self._count(guild_id, True)
+        return entry[1]
+
+    async def put(self, guild_id: int, model: str, system_prompt: str, prompt: str, content: str):
+        key = cache_key(guild_id, model, system_prompt, prompt)
+        expires_at = time.time() + self.ttl
+        self._store(key, expires_at, content)
+        if self.persist:
+            await self.db.set_cached_response(key, guild_id, content, expires_at)
+            now = time.time()
+            if now >= self._next_prune:
+                self._next_prune = now + self.prune_interval
+                await self.db.prune_cached_responses(now, self.max_rows)
+
+    def stats(self, guild_id: int = None):
+        if guild_id is None:
+            hits, misses = self.hits, self.misses
+        else:
+            hits, misses = self._guild_stats.get(guild_id, (0, 0))
+        total = hits + misses
+        return {
+            "size": len(self._entries),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
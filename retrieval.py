@@ -0,0 +1,266 @@
+import asyncio
+import os
+import re
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from conversation import estimate_tokens
+
+TOKEN_PATTERN = re.compile(r"\w+")
+# Too common to say anything about what a message is about
+STOPWORDS = frozenset(
+    "a an and are as at be but by did do does for from had has have he her his how i if in is it its "
+    "me my of on or our she so that the their them they this to was we were what when where which who "
+    "why will with you your".split()
+)
+# Snippets longer than this are cut before being added to a prompt
+MAX_SNIPPET_CHARS = 500
+
+class HashingEmbedder:
+    """Maps text to unit vectors by hashing words and word pairs into dim buckets.
+
+    Needs no vocabulary or training, so vectors can be computed as messages
+    arrive and stay comparable forever. crc32 is used instead of hash()
+    because the vectors are stored on disk and must match across restarts.
+    """
+
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    def features(self, text: str):
+        words = [word for word in TOKEN_PATTERN.findall(text.lower()) if word not in STOPWORDS]
+        return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+    def embed(self, texts):
+        rows, columns, signs = [], [], []
+        for index, text in enumerate(texts):
+            for feature in self.features(text):
+                digest = zlib.crc32(feature.encode("utf-8"))
+                rows.append(index)
+                columns.append(digest % self.dim)
+                # A second hash bit picks the sign, so bucket collisions tend to cancel out
+                signs.append(1.0 if digest & 0x80000000 else -1.0)
+
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(matrix, (rows, columns), signs)
+        # Sublinear term frequency, then unit length so a dot product is cosine similarity
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+class GuildIndex:
+    """One guild's vectors in a memory-mapped int8 file, appended in blocks.
+
+    Each block holds BLOCK_ROWS vectors stored bucket-major, so a search
+    only reads the handful of buckets the query touches instead of every
+    vector in full. Components are unit-vector coordinates scaled to
+    -127..127, a quarter of the size of float32 and plenty for ranking.
+    Which channel each row came from is kept in memory for filtering, and
+    the text lives in the database. Document frequencies per bucket are
+    kept alongside to weight queries TF-IDF style, so rare words count
+    for more than common ones.
+    """
+
+    BLOCK_ROWS = 4096
+    SCALE = 127
+
+    def __init__(self, path: str, dim: int, channel_ids):
+        self.path = path
+        self.dim = dim
+        self.count = len(channel_ids)
+        self.matrix = None
+        self.capacity = 0
+        self._open(self.count)
+        self.channels = np.zeros(self.capacity, dtype=np.int64)
+        self.channels[:self.count] = channel_ids
+        self.document_frequency = np.count_nonzero(self.matrix, axis=(0, 2)).astype(np.int64)
+
+    def _open(self, rows: int):
+        block_bytes = self.dim * self.BLOCK_ROWS
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        blocks = max(1, -(-rows // self.BLOCK_ROWS), size // block_bytes)
+        if size < blocks * block_bytes:
+            with open(self.path, "ab") as f:
+                f.truncate(blocks * block_bytes)
+        if self.matrix is not None:
+            self.matrix.flush()
+        self.matrix = np.memmap(self.path, dtype=np.int8, mode="r+", shape=(blocks, self.dim, self.BLOCK_ROWS))
+        self.capacity = blocks * self.BLOCK_ROWS
+
+    def append(self, vectors, channel_ids):
+        """Store vectors after the existing rows and return the first new row number."""
+        vectors = np.rint(vectors * self.SCALE).astype(np.int8)
+        first = self.count
+        needed = first + len(vectors)
+        if needed > self.capacity:
+            # Grow by doubling so the file is remapped a logarithmic number of times
+            self._open(max(needed, self.capacity * 2))
+            channels = np.zeros(self.capacity, dtype=np.int64)
+            channels[:first] = self.channels[:first]
+            self.channels = channels
+        row = first
+        while row < needed:
+            block, offset = divmod(row, self.BLOCK_ROWS)
+            end = min(needed, row - offset + self.BLOCK_ROWS)
+            self.matrix[block, :, offset:offset + end - row] = vectors[row - first:end - first].T
+            row = end
+        self.matrix.flush()
+        self.channels[first:needed] = channel_ids
+        self.document_frequency += np.count_nonzero(vectors, axis=0)
+        self.count = needed
+        return first
+
+    def search(self, query, channel_id: int, k: int, min_score: float):
+        """Return [(row, score)] for the k best rows from channel_id, best first."""
+        if not self.count:
+            return []
+        buckets = np.flatnonzero(query)
+        idf = np.log((self.count + 1) / (self.document_frequency[buckets] + 1)).astype(np.float32)
+        weighted = query[buckets] * idf
+        norm = np.linalg.norm(weighted)
+        if norm == 0:
+            return []
+        blocks = -(-self.count // self.BLOCK_ROWS)
+        columns = self.matrix[:blocks, buckets, :].astype(np.float32)
+        scores = np.einsum("bdr,d->br", columns, weighted / (norm * self.SCALE)).reshape(-1)
+        rows = np.flatnonzero(self.channels[:self.count] == channel_id)
+        if not len(rows):
+            return []
+        scores = scores[rows]
+        k = min(k, len(rows))
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(int(rows[i]), float(scores[i])) for i in top if scores[i] >= min_score]
+
+    def close(self):
+        if self.matrix is not None:
+            self.matrix.flush()
+            self.matrix = None
+
+class RetrievalIndex:
+    """Opt-in per-channel index of messages, searched for context on each question.
+
+    Messages from enabled channels are buffered as they arrive and indexed
+    in batches every flush_interval seconds: one vectorized embedding pass,
+    one append to the guild's matrix and one database transaction for the
+    text. A search flushes its guild first, then returns the top_k most
+    similar earlier messages from the channel that fit in token_budget.
+    At most max_open guild matrices are kept mapped at once.
+    """
+
+    def __init__(self, db, directory="retrieval", dim=512, top_k=5, token_budget=500, min_score=0.15,
+                 min_chars=20, flush_interval=5.0, max_open=64):
+        self.db = db
+        self.directory = directory
+        self.embedder = HashingEmbedder(dim)
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.min_score = min_score
+        self.min_chars = min_chars
+        self.flush_interval = flush_interval
+        self.max_open = max_open
+        # channel_id -> guild_id for every channel that opted in
+        self.channels = {}
+        self._indexes = OrderedDict()
+        # guild_id -> [(channel_id, message_id, author, content)] waiting to be indexed
+        self._pending = {}
+        self._flush_task = None
+        self._lock = asyncio.Lock()
+
+    async def init(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.channels = await self.db.get_retrieval_channels()
+
+    def enabled(self, channel_id: int):
+        return channel_id in self.channels
+
+    async def set_enabled(self, guild_id: int, channel_id: int, enabled: bool):
+        await self.db.set_retrieval_channel(guild_id, channel_id, enabled)
+        if enabled:
+            self.channels[channel_id] = guild_id
+        else:
+            self.channels.pop(channel_id, None)
+
+    def add(self, guild_id: int, channel_id: int, message_id: int, author: str, content: str):
+        """Queue a message from an enabled channel for indexing."""
+        if len(content) < self.min_chars:
+            return
+        self._pending.setdefault(guild_id, []).append((channel_id, message_id, author, content))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self._flush_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error indexing messages: {str(e)}")
+
+    async def _index(self, guild_id: int):
+        index = self._indexes.get(guild_id)
+        if index is not None:
+            self._indexes.move_to_end(guild_id)
+            return index
+        channel_ids = await self.db.get_retrieval_rows(guild_id)
+        index = self._indexes.get(guild_id)
+        if index is None:
+            path = os.path.join(self.directory, f"{guild_id}-{self.embedder.dim}.i8")
+            index = GuildIndex(path, self.embedder.dim, channel_ids)
+            self._indexes[guild_id] = index
+            if len(self._indexes) > self.max_open:
+                self._indexes.popitem(last=False)[1].close()
+        return index
+
+    async def flush(self, guild_id: int = None):
+        """Index queued messages, for one guild or all of them."""
+        async with self._lock:
+            guild_ids = [guild_id] if guild_id is not None else list(self._pending)
+            for guild in guild_ids:
+                messages = self._pending.pop(guild, None)
+                if not messages:
+                    continue
+                index = await self._index(guild)
+                vectors = self.embedder.embed([content for _, _, _, content in messages])
+                # Vectors first: rows without text are simply overwritten after a crash
+                first = index.append(vectors, [channel_id for channel_id, _, _, _ in messages])
+                await self.db.add_retrieval_snippets(guild, [
+                    (first + offset, *message) for offset, message in enumerate(messages)
+                ])
+
+    async def search(self, guild_id: int, channel_id: int, query: str, exclude_message_id: int = None):
+        """Return earlier messages relevant to query, formatted for the prompt, most relevant first."""
+        await self.flush(guild_id)
+        index = await self._index(guild_id)
+        vector = self.embedder.embed([query])[0]
+        # Fetch a few extra in case the question itself is among the hits
+        hits = index.search(vector, channel_id, self.top_k + 1, self.min_score)
+        if not hits:
+            return []
+        snippets = await self.db.get_retrieval_snippets(guild_id, [row for row, _ in hits])
+
+        results = []
+        tokens = 0
+        for row, _ in hits:
+            snippet = snippets.get(row)
+            if snippet is None or snippet[0] == exclude_message_id:
+                continue
+            _, author, content = snippet
+            text = f"{author}: {content[:MAX_SNIPPET_CHARS]}"
+            tokens += estimate_tokens(text)
+            if tokens > self.token_budget or len(results) == self.top_k:
+                break
+            results.append(text)
+        return results
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        for index in self._indexes.values():
+            index.close()
+        self._indexes.clear()
@@ -0,0 +1,81 @@
+import re
+
+AUTO_MODEL = "auto"
+CHAT_MODEL = "deepseek-chat"
+REASONER_MODEL = "deepseek-reasoner"
+
+# Phrases that usually mean the question needs multi-step reasoning
+DEFAULT_KEYWORDS = (
+    "prove", "proof", "derive", "step by step", "explain why", "why does",
+    "debug", "optimize", "algorithm", "complexity", "calculate", "solve",
+    "refactor", "analyze", "analyse", "compare", "trade-off", "tradeoff",
+    "theorem", "integral", "derivative", "equation", "puzzle", "riddle",
+)
+
+CODE_PATTERN = re.compile(
+    r"```|^\s*(def|class|function|import|from|#include|public|SELECT)\b|[{};]\s*$|=>|->",
+    re.MULTILINE
+)
+MATH_PATTERN = re.compile(r"\d\s*[-+*/^=<>]\s*\d|[∫∑√π≤≥≠]|\\(frac|sum|int|sqrt)|\b(mod|log|sin|cos|lim|sqrt)\b")
+
+class ModelRouter:
+    """Sends each prompt for the "auto" model to chat or the reasoner.
+
+    A prompt scores a point for being long (two if very long), one per
+    reasoning keyword (at most two), one for code and one for maths, and
+    goes to the reasoner once it reaches threshold. Everything else, like
+    greetings and quick lookups, gets the much faster chat model.
+
+    Latency saved is estimated per chat-routed prompt as the gap between
+    the two models' recent average completion times.
+    """
+
+    # Weight of the newest sample in the per-model latency averages
+    SMOOTHING = 0.1
+
+    def __init__(self, long_prompt=600, threshold=2, keywords=DEFAULT_KEYWORDS, metrics=None):
+        self.long_prompt = long_prompt
+        self.threshold = threshold
+        self.keywords = tuple(keyword.lower() for keyword in keywords)
+        self.metrics = metrics
+        # model -> moving average of completion seconds
+        self.latency = {}
+        self.decisions = {CHAT_MODEL: 0, REASONER_MODEL: 0}
+        self.saved_seconds = 0.0
+
+    def score(self, prompt: str):
+        text = prompt.lower()
+        score = 0
+        if len(prompt) >= self.long_prompt:
+            score += 2 if len(prompt) >= self.long_prompt * 2 else 1
+        score += min(2, sum(1 for keyword in self.keywords if keyword in text))
+        if CODE_PATTERN.search(prompt):
+            score += 1
+        if MATH_PATTERN.search(text):
+            score += 1
+        return score
+
+    def route(self, prompt: str):
+        """Pick the model for one prompt and record the decision."""
+        model = REASONER_MODEL if self.score(prompt) >= self.threshold else CHAT_MODEL
+        self.decisions[model] += 1
+        saved = 0.0
+        if model == CHAT_MODEL and CHAT_MODEL in self.latency and REASONER_MODEL in self.latency:
+            saved = max(0.0, self.latency[REASONER_MODEL] - self.latency[CHAT_MODEL])
+            self.saved_seconds += saved
+        if self.metrics is not None:
+            self.metrics.routes.inc(model)
+            self.metrics.route_saved.inc(amount=saved)
+        return model
+
+    def observe(self, model: str, seconds: float):
+        """Feed in a completion time, for the latency-saved estimate."""
+        average = self.latency.get(model)
+        self.latency[model] = seconds if average is None else average + self.SMOOTHING * (seconds - average)
+
+    def stats(self):
+        return {
+            "chat": self.decisions[CHAT_MODEL],
+            "reasoner": self.decisions[REASONER_MODEL],
+            "saved_seconds": self.saved_seconds,
+        }
@@ -0,0 +1,147 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+class SchedulerBusy(Exception):
+    """Raised when the request queue is full and a request can't even wait."""
+
+class RequestScheduler:
+    """Admission control for every DeepSeek call.
+
+    At most max_concurrency calls run at once, and at most per_guild of them
+    for any one guild. Requests beyond that wait in a per-guild FIFO, and
+    freed slots are handed to waiting guilds round-robin so one busy guild
+    can't starve the others. Once max_queue_per_guild of a guild's requests
+    are waiting, or max_queue in total, new ones are rejected with
+    SchedulerBusy instead of piling up, so one noisy guild can't take every
+    place in the queue either.
+    """
+
+    def __init__(self, max_concurrency=16, per_guild=2, max_queue=200, max_queue_per_guild=20):
+        self.max_concurrency = max_concurrency
+        self.per_guild = per_guild
+        self.max_queue = max_queue
+        self.max_queue_per_guild = max_queue_per_guild
+        self._active = 0
+        self._guild_active = {}
+        # guild_id -> deque of futures, plus the guilds that have waiters in turn order
+        self._waiters = {}
+        self._rotation = deque()
+        self._queued = 0
+        # Monitoring
+        self.started = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _can_start(self, guild_id):
+        return (
+            self._active < self.max_concurrency
+            and self._guild_active.get(guild_id, 0) < self.per_guild
+        )
+
+    def _grant(self, guild_id):
+        self._active += 1
+        self._guild_active[guild_id] = self._guild_active.get(guild_id, 0) + 1
+        self.started += 1
+
+    def _release(self, guild_id):
+        self._active -= 1
+        remaining = self._guild_active[guild_id] - 1
+        if remaining:
+            self._guild_active[guild_id] = remaining
+        else:
+            del self._guild_active[guild_id]
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._active < self.max_concurrency and self._rotation:
+            for _ in range(len(self._rotation)):
+                guild_id = self._rotation[0]
+                self._rotation.rotate(-1)
+                if self._guild_active.get(guild_id, 0) < self.per_guild:
+                    break
+            else:
+                # Every waiting guild is at its own cap
+                return
+
+            waiters = self._waiters[guild_id]
+            future = waiters.popleft()
+            if not waiters:
+                del self._waiters[guild_id]
+                self._rotation.remove(guild_id)
+            self._queued -= 1
+            self._grant(guild_id)
+            future.set_result(None)
+
+    def _remove_waiter(self, guild_id, future):
+        waiters = self._waiters.get(guild_id)
+        if waiters is None or future not in waiters:
+            return
+        waiters.remove(future)
+        self._queued -= 1
+        if not waiters:
+            del self._waiters[guild_id]
+            self._rotation.remove(guild_id)
+
+    @asynccontextmanager
+    async def slot(self, guild_id: int, on_queued=None):
+        """Hold one call slot for the duration of the block.
+
+        on_queued(position) is awaited if the request has to wait, so the
+        caller can tell the user where they are in line.
+        """
+        if guild_id not in self._waiters and self._can_start(guild_id):
+            self._grant(guild_id)
+        else:
+            guild_queued = len(self._waiters.get(guild_id, ()))
+            if guild_queued >= self.max_queue_per_guild:
+                self.rejected += 1
+                raise SchedulerBusy(f"{guild_queued} requests from this guild are already waiting")
+            if self._queued >= self.max_queue:
+                self.rejected += 1
+                raise SchedulerBusy(f"{self._queued} requests are already waiting")
+
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.setdefault(guild_id, deque()).append(future)
+            if guild_id not in self._rotation:
+                self._rotation.append(guild_id)
+            self._queued += 1
+            queued_at = time.monotonic()
+
+            try:
+                if on_queued is not None:
+                    try:
+                        await on_queued(self._queued)
+                    except Exception as e:
+                        print(f"Error sending queue position: {str(e)}")
+                await future
+            except BaseException:
+                if future.done() and not future.cancelled():
+                    # The slot was granted just as we were cancelled; hand it on
+                    self._release(guild_id)
+                else:
+                    future.cancel()
+                    self._remove_waiter(guild_id, future)
+                raise
+
+            waited = time.monotonic() - queued_at
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+        try:
+            yield
+        finally:
+            self._release(guild_id)
+
+    def stats(self):
+        return {
+            "active": self._active,
+            "queued": self._queued,
+            "queued_guilds": len(self._waiters),
+            "started": self.started,
+            "rejected": self.rejected,
+            "avg_wait": self.total_wait / self.started if self.started else 0.0,
+            "max_wait": self.max_wait,
+        }
@@ -0,0 +1,104 @@
+import asyncio
+import hashlib
+import json
+
+class Flight:
+    """One upstream completion shared by every identical request.
+
+    It quacks like a StreamingReply, so stream_completion can feed it
+    directly. Every requester replays the recorded events into its own
+    reply, starting from the beginning, so a late joiner catches up on
+    what has already streamed and then follows along live.
+    """
+
+    def __init__(self):
+        # Content deltas in arrival order; None marks a reasoning ("thinking") event
+        self.events = []
+        self.text = ""
+        self.done = False
+        self.error = None
+        self._wakeup = asyncio.Event()
+
+    def _notify(self):
+        self._wakeup.set()
+        self._wakeup = asyncio.Event()
+
+    async def thinking(self):
+        self.events.append(None)
+        self._notify()
+
+    async def feed(self, delta: str):
+        self.text += delta
+        self.events.append(delta)
+        self._notify()
+
+    async def finish(self):
+        return self.text
+
+class SingleFlight:
+    """Collapses identical in-flight completions into one upstream call."""
+
+    def __init__(self):
+        self._flights = {}
+        self.started = 0
+        self.shared = 0
+
+    @staticmethod
+    def key(api_key: str, model: str, messages: list):
+        payload = json.dumps([api_key, model, messages], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def _produce(self, key, flight, produce):
+        try:
+            await produce(flight)
+        except BaseException as e:
+            flight.error = e
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            flight.done = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight._notify()
+
+    async def run(self, key: str, produce, reply):
+        """Show the completion for key through reply and return its text.
+
+        produce(flight) performs the upstream call; it only runs if no
+        identical request is already in flight. Its error, if any, is raised
+        to every requester sharing the flight.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = Flight()
+            self._flights[key] = flight
+            self.started += 1
+            # Owned by the flight, not the requester, so one requester going
+            # away doesn't cancel the call for everyone else
+            flight.task = asyncio.create_task(self._produce(key, flight, produce))
+        else:
+            self.shared += 1
+
+        seen = 0
+        while True:
+            while seen < len(flight.events):
+                event = flight.events[seen]
+                seen += 1
+                if event is None:
+                    await reply.thinking()
+                else:
+                    await reply.feed(event)
+            if flight.done:
+                break
+            await flight._wakeup.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return await reply.finish()
+
+    def stats(self):
+        return {
+            "in_flight": len(self._flights),
+            "started": self.started,
+            "shared": self.shared,
+        }
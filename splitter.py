@@ -0,0 +1,92 @@
+DISCORD_LIMIT = 2000
+CONTINUED_PREFIX = "(continued) "
+# Room for the "(continued)" marker on follow-on messages
+MESSAGE_LIMIT = DISCORD_LIMIT - len(CONTINUED_PREFIX)
+
+FENCE = "```"
+
+def _backticks(text: str):
+    return len(text) - len(text.lstrip("`"))
+
+def _after_line(fence, line: str):
+    """The fence open after line, given the one open before it (None when outside code).
+
+    A fence opens with three or more backticks and an optional info string,
+    and only closes on a bare run of at least as many backticks, so a
+    ```` block can show markdown that contains ``` blocks.
+    """
+    stripped = line.strip()
+    run = _backticks(stripped)
+    if fence is None:
+        return stripped if run >= len(FENCE) else None
+    if run >= _backticks(fence) and stripped == "`" * run:
+        return None
+    return fence
+
+def _closing(fence: str):
+    return "`" * _backticks(fence)
+
+def continued(text: str):
+    """Mark a follow-on message, keeping a re-opened code fence on its own line."""
+    separator = "\n" if text.startswith(FENCE) else " "
+    return CONTINUED_PREFIX.rstrip() + separator + text
+
+def split_once(text: str, limit: int = MESSAGE_LIMIT):
+    """Cut one message off the front of text.
+
+    Returns (head, rest). head fits in limit and prefers to end at a
+    paragraph break, then a line break, then a space. If the cut lands
+    inside a code fence, head gets a closing fence and rest starts by
+    re-opening it with the same info string, so both render as code.
+    """
+    if len(text) <= limit:
+        return text, ""
+
+    fence = None
+    line_cut = paragraph_cut = line_fence = None
+    position = 0
+    for line in text.splitlines(keepends=True):
+        end = position + len(line)
+        after = _after_line(fence, line)
+        # A cut inside a fence needs room to close it
+        room = limit - (len(_closing(after)) + 1 if after is not None else 0)
+        if end > room or not line.endswith("\n"):
+            break
+        line_cut, line_fence = end, after
+        if not line.strip() and after is None:
+            paragraph_cut = end
+        fence = after
+        position = end
+
+    # Within the last quarter of the limit, prefer a paragraph or line break.
+    # Otherwise pack more prose in by breaking the next line at a space, but
+    # never break a code line if a line boundary is available.
+    room = limit - (len(_closing(fence)) + 1 if fence is not None else 0)
+    space = text.rfind(" ", position, room)
+    if paragraph_cut is not None and paragraph_cut >= limit * 3 // 4:
+        cut, fence = paragraph_cut, None
+    elif line_cut is not None and line_cut >= limit * 3 // 4:
+        cut, fence = line_cut, line_fence
+    elif space > position and fence is None:
+        cut = space + 1
+    elif line_cut is not None and line_cut > len(fence or "") + 1:
+        cut, fence = line_cut, line_fence
+    elif space > position:
+        cut = space + 1
+    else:
+        cut = room
+
+    head, rest = text[:cut].rstrip(), text[cut:]
+    if fence is not None:
+        head += "\n" + _closing(fence)
+        rest = fence + "\n" + rest
+    return head, rest.lstrip("\n") if fence is None else rest
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT):
+    """Split text into as few messages of at most limit characters as possible."""
+    chunks = []
+    while text:
+        head, text = split_once(text, limit)
+        if head.strip():
+            chunks.append(head)
+    return chunks
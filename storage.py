@@ -0,0 +1,353 @@
+import asyncio
+import sqlite3
+from abc import ABC, abstractmethod
+from urllib.parse import unquote, urlparse
+
+# Per-guild settings columns, and what a guild that never set one reads as
+SETTINGS_COLUMNS = (
+    "api_key",
+    "current_model",
+    "welcome_sent",
+    "response_cache",
+    "system_prompt",
+)
+DEFAULT_SETTINGS = {
+    "api_key": None,
+    "current_model": "deepseek-chat",
+    "welcome_sent": 0,
+    "response_cache": 0,
+    "system_prompt": None,
+}
+# Stored as text by stores that only have strings, and turned back into ints on read
+INTEGER_SETTINGS = ("welcome_sent", "response_cache")
+
+class SettingsStore(ABC):
+    """Where guild settings and process-wide state are kept.
+
+    Database keeps the write-behind queue and the per-setting getters and
+    routes every read and write of settings through one of these. A guild's
+    row is a dict over SETTINGS_COLUMNS; a guild that has never been
+    written has no row. update_settings applies a whole batch of partial
+    rows atomically, so a deferred flush is one round trip. init and close
+    default to doing nothing; a store missing any other method can't be
+    constructed.
+    """
+
+    async def init(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def get_settings(self, guild_id: int):
+        """Return a guild's row with defaults filled in, or None if it has none."""
+
+    @abstractmethod
+    async def get_all_settings(self):
+        """Return {guild_id: row} for every guild with a row."""
+
+    @abstractmethod
+    async def update_settings(self, updates: dict):
+        """Apply {guild_id: {column: value}}, creating rows as needed; None clears a value."""
+
+    @abstractmethod
+    async def get_state(self, key: str):
+        ...
+
+    @abstractmethod
+    async def set_state(self, key: str, value: str):
+        ...
+
+class SQLiteSettingsStore(SettingsStore):
+    """The settings and bot_state tables, on Database's shared connection."""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def init(self):
+        conn = self.db.conn
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS settings (
+                guild_id INTEGER PRIMARY KEY,
+                api_key TEXT,
+                current_model TEXT DEFAULT 'deepseek-chat',
+                -- No longer used; /model messages are handled by a persistent view
+                model_message_id INTEGER,
+                model_channel_id INTEGER,
+                welcome_sent INTEGER DEFAULT 0,
+                response_cache INTEGER DEFAULT 0,
+                system_prompt TEXT
+            )
+        """)
+        # Columns added after the original schema, for databases created before them
+        async with conn.execute("PRAGMA table_info(settings)") as cursor:
+            existing = {row[1] for row in await cursor.fetchall()}
+        for column, definition in (("response_cache", "INTEGER DEFAULT 0"), ("system_prompt", "TEXT")):
+            if column not in existing:
+                try:
+                    await conn.execute(f"ALTER TABLE settings ADD COLUMN {column} {definition}")
+                except sqlite3.OperationalError as e:
+                    # Another shard process added it first
+                    if "duplicate column" not in str(e):
+                        raise
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS bot_state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+
+    async def _upsert(self, guild_id: int, values: dict):
+        columns = ", ".join(values)
+        placeholders = ", ".join("?" for _ in values)
+        assignments = ", ".join(f"{column} = excluded.{column}" for column in values)
+        await self.db.conn.execute(
+            f"""INSERT INTO settings (guild_id, {columns}) VALUES (?, {placeholders})
+                ON CONFLICT(guild_id) DO UPDATE SET {assignments}""",
+            (guild_id, *values.values())
+        )
+
+    async def get_settings(self, guild_id: int):
+        async with self.db.conn.execute(
+            f"SELECT {', '.join(SETTINGS_COLUMNS)} FROM settings WHERE guild_id = ?",
+            (guild_id,)
+        ) as cursor:
+            result = await cursor.fetchone()
+            return dict(zip(SETTINGS_COLUMNS, result)) if result else None
+
+    async def get_all_settings(self):
+        async with self.db.conn.execute(
+            f"SELECT guild_id, {', '.join(SETTINGS_COLUMNS)} FROM settings"
+        ) as cursor:
+            return {row[0]: dict(zip(SETTINGS_COLUMNS, row[1:])) for row in await cursor.fetchall()}
+
+    async def update_settings(self, updates: dict):
+        async def write():
+            for guild_id, values in updates.items():
+                if values:
+                    await self._upsert(guild_id, values)
+
+        await self.db._transaction(write)
+
+    async def get_state(self, key: str):
+        async with self.db.conn.execute(
+            "SELECT value FROM bot_state WHERE key = ?",
+            (key,)
+        ) as cursor:
+            result = await cursor.fetchone()
+            return result[0] if result else None
+
+    async def set_state(self, key: str, value: str):
+        await self.db._transaction(lambda: self.db.conn.execute(
+            """INSERT INTO bot_state (key, value) VALUES (?, ?)
+               ON CONFLICT(key) DO UPDATE SET value = excluded.value""",
+            (key, value)
+        ))
+
+class MemorySettingsStore(SettingsStore):
+    """Settings in a dict, gone when the process exits. For tests and benchmarks."""
+
+    def __init__(self):
+        self.rows = {}
+        self.state = {}
+
+    async def get_settings(self, guild_id: int):
+        row = self.rows.get(guild_id)
+        return dict(row) if row is not None else None
+
+    async def get_all_settings(self):
+        return {guild_id: dict(row) for guild_id, row in self.rows.items()}
+
+    async def update_settings(self, updates: dict):
+        for guild_id, values in updates.items():
+            if values:
+                self.rows.setdefault(guild_id, dict(DEFAULT_SETTINGS)).update(values)
+
+    async def get_state(self, key: str):
+        return self.state.get(key)
+
+    async def set_state(self, key: str, value: str):
+        self.state[key] = value
+
+class RedisError(Exception):
+    """An error reply from the Redis server."""
+
+class RedisConnection:
+    """A minimal RESP client: one connection, pipelined commands, reconnects on demand."""
+
+    def __init__(self, host="127.0.0.1", port=6379, db=0, password=None, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _encode(command):
+        parts = [f"*{len(command)}\r\n".encode()]
+        for arg in command:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    async def _read(self):
+        line = await self._reader.readuntil(b"\r\n")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode("utf-8")
+        if kind == b"-":
+            # Returned rather than raised so the rest of a pipeline is still read
+            return RedisError(body.decode("utf-8"))
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            return (await self._reader.readexactly(length + 2))[:-2].decode("utf-8")
+        if kind == b"*":
+            length = int(body)
+            if length < 0:
+                return None
+            return [await self._read() for _ in range(length)]
+        raise RedisError(f"Unexpected reply from Redis: {line!r}")
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            await self._send(setup)
+
+    async def _send(self, commands):
+        self._writer.write(b"".join(self._encode(command) for command in commands))
+        await self._writer.drain()
+        replies = [await self._read() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    async def pipeline(self, *commands):
+        """Send commands in one round trip and return their replies in order."""
+        async with self._lock:
+            try:
+                if self._writer is None:
+                    try:
+                        await asyncio.wait_for(self._connect(), self.timeout)
+                    except RedisError:
+                        # e.g. a wrong password: don't keep an unauthenticated connection
+                        await self.close()
+                        raise
+                return await asyncio.wait_for(self._send(commands), self.timeout)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                # The connection may be half-read; start afresh on the next call
+                await self.close()
+                raise
+
+    async def execute(self, *command):
+        return (await self.pipeline(command))[0]
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+            self._reader = self._writer = None
+
+class RedisSettingsStore(SettingsStore):
+    """Settings in a Redis (or Redis-protocol) server shared by every bot host.
+
+    Each guild's row is a hash at {prefix}settings:{guild_id}, the set
+    {prefix}guilds lists the guilds that have one, and process-wide state
+    is the hash {prefix}state. A batch of updates is one MULTI/EXEC.
+    """
+
+    def __init__(self, url="redis://127.0.0.1:6379/0", prefix="deepseek:"):
+        parsed = urlparse(url)
+        self.connection = RedisConnection(
+            host=parsed.hostname or "127.0.0.1",
+            port=parsed.port or 6379,
+            db=int(parsed.path.lstrip("/") or 0),
+            password=unquote(parsed.password) if parsed.password else None,
+        )
+        self.prefix = prefix
+
+    def _key(self, guild_id: int):
+        return f"{self.prefix}settings:{guild_id}"
+
+    @staticmethod
+    def _row(fields):
+        row = dict(DEFAULT_SETTINGS)
+        for column, value in zip(fields[::2], fields[1::2]):
+            if column in row:
+                row[column] = int(value) if column in INTEGER_SETTINGS else value
+        return row
+
+    async def init(self):
+        await self.connection.execute("PING")
+
+    async def close(self):
+        await self.connection.close()
+
+    async def get_settings(self, guild_id: int):
+        fields, exists = await self.connection.pipeline(
+            ("HGETALL", self._key(guild_id)),
+            ("SISMEMBER", f"{self.prefix}guilds", guild_id),
+        )
+        return self._row(fields) if exists else None
+
+    async def get_all_settings(self):
+        guild_ids = [int(guild_id) for guild_id in await self.connection.execute("SMEMBERS", f"{self.prefix}guilds")]
+        if not guild_ids:
+            return {}
+        rows = await self.connection.pipeline(*(("HGETALL", self._key(guild_id)) for guild_id in guild_ids))
+        return {guild_id: self._row(fields) for guild_id, fields in zip(guild_ids, rows)}
+
+    async def update_settings(self, updates: dict):
+        commands = [("MULTI",)]
+        for guild_id, values in updates.items():
+            if not values:
+                continue
+            assigned = [part for column, value in values.items() if value is not None for part in (column, value)]
+            cleared = [column for column, value in values.items() if value is None]
+            if assigned:
+                commands.append(("HSET", self._key(guild_id), *assigned))
+            if cleared:
+                commands.append(("HDEL", self._key(guild_id), *cleared))
+            commands.append(("SADD", f"{self.prefix}guilds", guild_id))
+        if len(commands) == 1:
+            return
+        commands.append(("EXEC",))
+        results = (await self.connection.pipeline(*commands))[-1]
+        for result in results or ():
+            if isinstance(result, RedisError):
+                raise result
+
+    async def get_state(self, key: str):
+        return await self.connection.execute("HGET", f"{self.prefix}state", key)
+
+    async def set_state(self, key: str, value: str):
+        await self.connection.execute("HSET", f"{self.prefix}state", key, value)
+
+def parse_store(spec: str):
+    """Build the store named by SETTINGS_STORE: "sqlite", "memory" or a redis:// URL.
+
+    "sqlite" (the default) returns None, meaning Database's own tables.
+    """
+    if not spec or spec == "sqlite":
+        return None
+    if spec == "memory":
+        return MemorySettingsStore()
+    if spec.startswith("redis://"):
+        return RedisSettingsStore(spec)
+    raise ValueError(f"Unknown settings store: {spec}")
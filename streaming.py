@@ -0,0 +1,170 @@
+import asyncio
+import time
+
+from splitter import MESSAGE_LIMIT, continued, split_once
+
+class StreamingReply:
+    """Shows a streamed completion in Discord as it arrives.
+
+    The first message goes out as soon as there is text to show. It is then
+    edited in place at most once per edit_interval seconds, which keeps us
+    under Discord's per-channel edit rate limit. When the text outgrows a
+    message the current one is finalised at a markdown-friendly break and a
+    new one is started. Once the answer passes attach_over characters no
+    more messages are started; the whole answer is sent as a file instead.
+
+    send_first(text) posts the first message and send_next(text, first)
+    posts each follow-on message, which is given already marked with
+    continued() and keeps the mark through later edits; send_file(note,
+    text, first) posts the answer as an attachment. All of them must
+    return the sent message.
+    """
+
+    def __init__(self, send_first, send_next, send_file=None, edit_interval=1.0,
+                 limit=MESSAGE_LIMIT, attach_over=None, observe=None):
+        self.send_first = send_first
+        self.send_next = send_next
+        self.send_file = send_file
+        self.edit_interval = edit_interval
+        self.limit = limit
+        self.attach_over = attach_over if send_file is not None else None
+        # observe(action, seconds) is told how long each Discord call took
+        self.observe = observe
+        self.messages = []
+        self.text = ""
+        self._buffer = ""
+        self._current = None
+        self._shown = ""
+        self._last_edit = 0.0
+        self._edit_task = None
+        self._placeholder = False
+        self._attaching = False
+
+    def _observe(self, action, started):
+        if self.observe is not None:
+            self.observe(action, time.monotonic() - started)
+
+    async def _post(self, text):
+        started = time.monotonic()
+        if self.messages:
+            message = await self.send_next(continued(text), self.messages[0])
+        else:
+            message = await self.send_first(text)
+        self._observe("send", started)
+        self.messages.append(message)
+        self._current = message
+        self._shown = text
+        self._placeholder = False
+        self._last_edit = time.monotonic()
+
+    async def _edit(self, text):
+        started = time.monotonic()
+        # Every message but the first carries the "(continued)" mark
+        content = continued(text) if self._current is not self.messages[0] else text
+        await self._current.edit(content=content)
+        self._observe("edit", started)
+        self._shown = text
+        self._placeholder = False
+        self._last_edit = time.monotonic()
+
+    async def _settle(self):
+        # Wait for a background edit so edits never land out of order
+        if self._edit_task is not None:
+            task, self._edit_task = self._edit_task, None
+            try:
+                await task
+            except Exception as e:
+                print(f"Error editing streamed message: {str(e)}")
+
+    async def _show(self, text):
+        await self._settle()
+        if self._current is None:
+            await self._post(text)
+        elif text != self._shown:
+            await self._edit(text)
+
+    async def thinking(self, placeholder="*Thinking...*"):
+        """Post a placeholder while the model reasons before its first token."""
+        if self._current is None and not self.messages:
+            await self._post(placeholder)
+            self._placeholder = True
+
+    async def feed(self, delta: str):
+        self.text += delta
+        if self._attaching:
+            return
+        if self.attach_over and len(self.text) > self.attach_over:
+            # Too long to be worth a string of rate-limited sends; the full
+            # answer goes out as one file when the stream ends
+            self._attaching = True
+            return
+        self._buffer += delta
+
+        while len(self._buffer) > self.limit:
+            head, self._buffer = split_once(self._buffer, self.limit)
+            await self._show(head)
+            self._current = None
+
+        if not self._buffer.strip():
+            return
+        if self._current is None or self._placeholder:
+            await self._show(self._buffer)
+        elif time.monotonic() - self._last_edit >= self.edit_interval and (
+            self._edit_task is None or self._edit_task.done()
+        ):
+            await self._settle()
+            # Edit in the background so a slow or rate-limited edit doesn't
+            # hold up reading the rest of the stream
+            self._edit_task = asyncio.create_task(self._edit(self._buffer))
+
+    async def finish(self):
+        """Show whatever is still buffered and return the full text."""
+        if self._attaching:
+            await self._settle()
+            note = f"The full response ({len(self.text):,} characters) is attached."
+            if self._placeholder:
+                await self._edit(note)
+                note = None
+            first = self.messages[0] if self.messages else None
+            started = time.monotonic()
+            self.messages.append(await self.send_file(note, self.text, first))
+            self._observe("send_file", started)
+            return self.text
+        if self._buffer.strip():
+            await self._show(self._buffer)
+        else:
+            await self._settle()
+        if not self.text.strip():
+            await self._show("DeepSeek returned an empty response.")
+        return self.text
+
+async def stream_completion(client, model, messages, reply, on_first_token=None):
+    """Stream a chat completion into reply (a StreamingReply or Flight).
+
+    Calls on_first_token() when the first content or reasoning token arrives
+    and returns the response.usage reported at the end of the stream.
+    """
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    usage = None
+    first = True
+    async for chunk in stream:
+        if chunk.usage is not None:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        reasoning = getattr(delta, "reasoning_content", None)
+        if first and (delta.content or reasoning):
+            first = False
+            if on_first_token is not None:
+                on_first_token()
+        if delta.content:
+            await reply.feed(delta.content)
+        elif reasoning:
+            await reply.thinking()
+    return usage
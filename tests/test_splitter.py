@@ -0,0 +1,149 @@
+"""split_message over a corpus of long answers.
+
+Each answer in the corpus (prose, long code fences, mixed fences, long
+lines with and without spaces, and ```` fences wrapping ``` ones) is split
+and every chunk must fit in Discord's limit once marked with continued(),
+leave no code fence open and lose no text, in no more chunks than needed.
+"""
+import math
+import random
+
+import pytest
+
+from splitter import DISCORD_LIMIT, MESSAGE_LIMIT, continued, split_message
+
+WORDS = (
+    "the model reads each token and predicts the next one from everything before it so a longer "
+    "context costs more time and memory but usually gives a better answer when the question depends "
+    "on earlier details such as names numbers or code"
+).split()
+
+
+def sentence(rng, words=None):
+    words = words or rng.randint(6, 20)
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + "."
+
+
+def paragraph(rng, sentences=None):
+    return " ".join(sentence(rng) for _ in range(sentences or rng.randint(2, 8)))
+
+
+def code_line(rng, number):
+    return f"    result_{number} = compute(values[{number}], scale={rng.randint(1, 99)})  # step {number}"
+
+
+def code_block(rng, lines, language="python", fence="```"):
+    body = "\n".join(code_line(rng, number) for number in range(lines))
+    return f"{fence}{language}\n{body}\n{fence}"
+
+
+def prose(rng):
+    return "\n\n".join(paragraph(rng) for _ in range(40))
+
+
+def long_code(rng):
+    return "Here is the full module:\n\n" + code_block(rng, 300) + "\n\nThat's all of it."
+
+
+def mixed_fences(rng):
+    parts = []
+    for number in range(12):
+        parts.append(paragraph(rng))
+        language = ("python", "js", "", "bash")[number % 4]
+        parts.append(code_block(rng, rng.randint(3, 60), language))
+    return "\n\n".join(parts)
+
+
+def long_spaced_line(rng):
+    # One 9000-character line of prose: no line breaks to cut at
+    return " ".join(sentence(rng) for _ in range(120))
+
+
+def long_unspaced_line(rng):
+    # Nothing to break at, like a base64 blob or a minified file
+    return "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/") for _ in range(7000))
+
+
+def long_line_in_code(rng):
+    blob = "".join(rng.choice("0123456789abcdef") for _ in range(5000))
+    return "The payload:\n\n```text\n" + blob + "\n```\n\n" + paragraph(rng)
+
+
+def nested_fences(rng):
+    # A ```` fence showing markdown that itself contains ``` fences
+    inner = "\n\n".join(
+        f"Example {number}:\n\n" + code_block(rng, rng.randint(5, 30), "python")
+        for number in range(8)
+    )
+    return "Write your README like this:\n\n````markdown\n" + inner + "\n````\n\n" + paragraph(rng)
+
+
+def short(rng):
+    return paragraph(rng, 3)
+
+
+CORPUS = [
+    prose,
+    long_code,
+    mixed_fences,
+    long_spaced_line,
+    long_unspaced_line,
+    long_line_in_code,
+    nested_fences,
+    short,
+]
+
+
+def open_fence(text):
+    """Return the fence still open at the end of text, or None (CommonMark backtick fences)."""
+    fence = None
+    for line in text.splitlines():
+        stripped = line.strip()
+        run = len(stripped) - len(stripped.lstrip("`"))
+        if fence is None:
+            if run >= 3:
+                fence = "`" * run
+        elif run >= len(fence) and stripped == "`" * run:
+            fence = None
+    return fence
+
+
+def content(texts):
+    """The non-fence text of texts with all whitespace removed, for comparing content."""
+    lines = [line for text in texts for line in text.splitlines() if not line.strip().startswith("```")]
+    return "".join("".join(lines).split())
+
+
+@pytest.fixture(params=CORPUS, ids=lambda make: make.__name__)
+def answer(request):
+    text = request.param(random.Random(request.param.__name__))
+    return text, split_message(text)
+
+
+def test_chunks_fit_discord_limit(answer):
+    _, chunks = answer
+    for number, chunk in enumerate(chunks):
+        shown = continued(chunk) if number else chunk
+        assert len(shown) <= DISCORD_LIMIT, f"chunk {number}"
+
+
+def test_no_fence_left_open(answer):
+    _, chunks = answer
+    for number, chunk in enumerate(chunks):
+        assert open_fence(chunk) is None, f"chunk {number}"
+
+
+def test_no_text_lost(answer):
+    # Chunks may only gain fence lines and lose whitespace at the cuts
+    text, chunks = answer
+    assert content(chunks) == content([text])
+
+
+def test_no_more_chunks_than_needed(answer):
+    # Closing and re-opening fences costs a little room per cut, and a cut
+    # prefers a break in the last quarter of the limit
+    text, chunks = answer
+    needed = math.ceil(len(text) / MESSAGE_LIMIT)
+    allowed = math.ceil(len(text) / (MESSAGE_LIMIT * 3 // 4))
+    assert len(chunks) <= max(needed, allowed)
@@ -0,0 +1,218 @@
+"""The same settings-storage checks against every SettingsStore.
+
+Each check gets a fresh Database backed by SQLite, by MemorySettingsStore
+and by RedisSettingsStore. Redis runs against benchmarks/fake_redis.py
+unless TEST_REDIS_URL points at a real server (whose database is flushed).
+"""
+import asyncio
+import os
+
+import pytest
+
+from database import Database
+from fake_redis import FakeRedis
+from guild_settings import GuildSettings
+from storage import DEFAULT_SETTINGS, MemorySettingsStore, RedisSettingsStore, SettingsStore
+
+
+async def check_empty(db, reopen):
+    assert await db.get_settings(1) is None
+    assert await db.get_all_settings() == {}
+    assert await db.get_api_key(1) is None
+    assert await db.get_model(1) == "deepseek-chat"
+    assert await db.get_welcome_sent(1) is False
+    assert await db.get_response_cache(1) is False
+    assert await db.get_system_prompt(1) is None
+
+
+async def check_round_trip(db, reopen):
+    await db.set_api_key(1, "sk-one")
+    assert await db.get_settings(1) == dict(DEFAULT_SETTINGS, api_key="sk-one")
+    await db.set_model(1, "deepseek-reasoner")
+    await db.set_welcome_sent(1)
+    await db.set_response_cache(1, True)
+    await db.set_system_prompt(1, "Answer in French, ünïcödé and all")
+    assert await db.get_api_key(1) == "sk-one"
+    assert await db.get_model(1) == "deepseek-reasoner"
+    assert await db.get_welcome_sent(1) is True
+    assert await db.get_response_cache(1) is True
+    assert await db.get_system_prompt(1) == "Answer in French, ünïcödé and all"
+    # Integers come back as integers even from stores that only hold strings
+    assert (await db.get_settings(1))["welcome_sent"] == 1
+
+
+async def check_partial_updates(db, reopen):
+    await db.set_api_key(1, "sk-one")
+    await db.set_system_prompt(1, "Be brief")
+    await db.set_api_key(1, "sk-two")
+    assert await db.get_system_prompt(1) == "Be brief"
+    await db.set_system_prompt(1, None)
+    assert await db.get_system_prompt(1) is None
+    assert await db.get_api_key(1) == "sk-two"
+    await db.set_response_cache(1, True)
+    await db.set_response_cache(1, False)
+    assert await db.get_response_cache(1) is False
+
+
+async def check_null_only_row(db, reopen):
+    # Writing only a cleared value still creates the guild's row
+    await db.set_system_prompt(2, None)
+    assert await db.get_settings(2) == DEFAULT_SETTINGS
+    assert list(await db.get_all_settings()) == [2]
+
+
+async def check_all_settings(db, reopen):
+    for guild_id in range(1, 51):
+        await db.set_api_key(guild_id, f"sk-{guild_id}")
+    await db.set_model(7, "deepseek-reasoner")
+    rows = await db.get_all_settings()
+    assert sorted(rows) == list(range(1, 51))
+    assert rows[7] == dict(DEFAULT_SETTINGS, api_key="sk-7", current_model="deepseek-reasoner")
+    assert rows[8]["current_model"] == "deepseek-chat"
+
+
+async def check_large_ids(db, reopen):
+    guild_id = 1234567890123456789
+    await db.set_api_key(guild_id, "sk-snowflake")
+    assert await db.get_api_key(guild_id) == "sk-snowflake"
+    assert list(await db.get_all_settings()) == [guild_id]
+
+
+async def check_deferred_writes(db, reopen):
+    db.flush_interval = 60
+    await db.set_model(1, "deepseek-reasoner", defer=True)
+    await db.set_welcome_sent(1, defer=True)
+    await db.set_welcome_sent(2, defer=True)
+    assert await db.get_model(1) == "deepseek-reasoner"
+    assert sorted(await db.get_all_settings()) == [1, 2]
+    await db.set_model(1, "deepseek-chat")
+    assert await db.get_model(1) == "deepseek-chat"
+    await db.flush()
+    assert db._pending == {}
+    assert await db.store.get_settings(1) == dict(DEFAULT_SETTINGS, welcome_sent=1)
+    assert (await db.store.get_settings(2))["welcome_sent"] == 1
+
+
+async def check_state(db, reopen):
+    assert await db.get_state("command_hash") is None
+    await db.set_state("command_hash", "abc")
+    await db.set_state("command_hash", "def")
+    await db.set_state("other", "")
+    assert await db.get_state("command_hash") == "def"
+    assert await db.get_state("other") == ""
+
+
+async def check_concurrent_writes(db, reopen):
+    await asyncio.gather(*(db.set_api_key(guild_id, f"sk-{guild_id}") for guild_id in range(100)))
+    keys = await asyncio.gather(*(db.get_api_key(guild_id) for guild_id in range(100)))
+    assert keys == [f"sk-{guild_id}" for guild_id in range(100)]
+
+
+async def check_guild_settings(db, reopen):
+    settings = GuildSettings(db)
+    await settings.set_api_key(3, "sk-three")
+    await settings.set_system_prompt(3, "Hi")
+    settings.invalidate()
+    assert await settings.get_api_key(3) == "sk-three"
+    assert await settings.get_model(3) == "deepseek-chat"
+    assert await settings.get_system_prompt(3) == "Hi"
+
+
+async def check_persistence(db, reopen):
+    await db.set_api_key(4, "sk-four")
+    await db.set_state("command_hash", "abc")
+    db = await reopen(db)
+    if db is None:
+        return
+    try:
+        assert await db.get_api_key(4) == "sk-four"
+        assert await db.get_state("command_hash") == "abc"
+    finally:
+        await db.close()
+
+
+CHECKS = [
+    check_empty,
+    check_round_trip,
+    check_partial_updates,
+    check_null_only_row,
+    check_all_settings,
+    check_large_ids,
+    check_deferred_writes,
+    check_state,
+    check_concurrent_writes,
+    check_guild_settings,
+    check_persistence,
+]
+
+
+async def open_sqlite(tmp_path):
+    path = str(tmp_path / "settings.db")
+
+    async def reopen(db):
+        await db.close()
+        db = Database(path)
+        await db.init()
+        return db
+
+    return Database(path), reopen
+
+
+async def open_memory(tmp_path):
+    async def reopen(db):
+        # Nothing to persist to; the check stops here
+        await db.close()
+        return None
+
+    return Database(":memory:", store=MemorySettingsStore()), reopen
+
+
+async def open_redis(redis_url):
+    store = RedisSettingsStore(redis_url)
+    await store.connection.execute("FLUSHDB")
+
+    async def reopen(db):
+        await db.close()
+        db = Database(":memory:", store=RedisSettingsStore(redis_url))
+        await db.init()
+        return db
+
+    return Database(":memory:", store=store), reopen
+
+
+async def run(store, check, tmp_path):
+    fake = None
+    try:
+        if store == "sqlite":
+            db, reopen = await open_sqlite(tmp_path)
+        elif store == "memory":
+            db, reopen = await open_memory(tmp_path)
+        else:
+            redis_url = os.getenv("TEST_REDIS_URL")
+            if not redis_url:
+                fake = FakeRedis()
+                redis_url = await fake.start()
+            db, reopen = await open_redis(redis_url)
+        await db.init()
+        try:
+            await check(db, reopen)
+        finally:
+            await db.close()
+    finally:
+        if fake is not None:
+            await fake.stop()
+
+
+@pytest.mark.parametrize("check", CHECKS, ids=lambda check: check.__name__[len("check_"):])
+@pytest.mark.parametrize("store", ["sqlite", "memory", "redis"])
+def test_store(store, check, tmp_path):
+    asyncio.run(run(store, check, tmp_path))
+
+
+def test_incomplete_store_cannot_be_constructed():
+    class Incomplete(SettingsStore):
+        async def get_settings(self, guild_id: int):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,78 @@
+import asyncio
+
+from database import USAGE_COLUMNS
+
+class UsageTracker:
+    """Per-guild token usage, counted in memory and written to SQLite in batches.
+
+    record() is called for every completion and only touches a dict; the
+    accumulated counts are added to the guild_usage table in one transaction
+    every flush_interval seconds, and on close.
+    """
+
+    def __init__(self, db, flush_interval=30.0):
+        self.db = db
+        self.flush_interval = flush_interval
+        # (guild_id, model) -> [count per USAGE_COLUMNS] not yet written
+        self._pending = {}
+        self._flush_task = None
+
+    def record(self, guild_id: int, model: str, usage):
+        if usage is None:
+            return
+        # prompt_cache_* are DeepSeek extensions to the OpenAI usage object
+        values = (
+            1,
+            usage.prompt_tokens or 0,
+            usage.completion_tokens or 0,
+            getattr(usage, "prompt_cache_hit_tokens", None) or 0,
+            getattr(usage, "prompt_cache_miss_tokens", None) or 0,
+        )
+        counts = self._pending.get((guild_id, model))
+        if counts is None:
+            self._pending[(guild_id, model)] = list(values)
+        else:
+            for index, value in enumerate(values):
+                counts[index] += value
+
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self._flush_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error flushing usage: {str(e)}")
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            await self.db.add_usage(pending)
+        except Exception:
+            # Fold the batch back into whatever was recorded meanwhile
+            for key, counts in pending.items():
+                current = self._pending.setdefault(key, [0] * len(USAGE_COLUMNS))
+                for index, value in enumerate(counts):
+                    current[index] += value
+            raise
+
+    async def get(self, guild_id: int):
+        """A guild's totals as {model: {column: count}}, including unflushed counts."""
+        totals = await self.db.get_usage(guild_id)
+        for (pending_guild, model), counts in self._pending.items():
+            if pending_guild != guild_id:
+                continue
+            row = totals.setdefault(model, dict.fromkeys(USAGE_COLUMNS, 0))
+            for column, value in zip(USAGE_COLUMNS, counts):
+                row[column] += value
+        return totals
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()